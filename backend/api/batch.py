@@ -0,0 +1,67 @@
+from django.db import connection
+from django.db.models import Exists, OuterRef
+
+from api.serializers import BatchSerializer
+
+
+def add_batch(request, model, targets, owner_field, target_field,
+              forbidden=()):
+    """Пакетное добавление связей текущего пользователя с объектами.
+
+    Существование объектов и уже имеющиеся связи проверяются одним
+    запросом, новые связи вставляются одним INSERT ... ON CONFLICT DO
+    NOTHING RETURNING. Добавленными считаются только id, которые
+    вернула вставка: связь, вставленную параллельным запросом,
+    повторно не учитываем. Возвращает результат по каждому id и
+    список id добавленных объектов.
+    """
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = list(dict.fromkeys(serializer.validated_data['ids']))
+    user = request.user
+    found = dict(targets.filter(pk__in=ids).annotate(linked=Exists(
+        model.objects.filter(
+            **{owner_field: user, target_field: OuterRef('pk')}
+        )
+    )).values_list('pk', 'linked'))
+    candidates = [
+        pk for pk in ids
+        if pk in found and pk not in forbidden and not found[pk]
+    ]
+    added = insert_links(
+        model, owner_field, target_field, user.pk, candidates
+    )
+    results = []
+    for pk in ids:
+        if pk not in found:
+            result = 'not_found'
+        elif pk in forbidden:
+            result = 'forbidden'
+        elif pk in added:
+            result = 'added'
+        else:
+            result = 'exists'
+        results.append({'id': pk, 'status': result})
+    return results, [pk for pk in ids if pk in added]
+
+
+def insert_links(model, owner_field, target_field, owner_id, target_ids):
+    """Вставка связей без ошибки при гонке; множество вставленных id.
+
+    Объекты блокируются FOR SHARE, как и при добавлении по одному.
+    """
+    if not target_ids:
+        return set()
+    owner = model._meta.get_field(owner_field).column
+    target_field = model._meta.get_field(target_field)
+    target = target_field.column
+    targets = target_field.related_model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {model._meta.db_table} ({owner}, {target}) '
+            f'SELECT %s, id FROM {targets} WHERE id = ANY(%s) '
+            f'ORDER BY id FOR SHARE '
+            f'ON CONFLICT DO NOTHING RETURNING {target}',
+            [owner_id, target_ids]
+        )
+        return {row[0] for row in cursor.fetchall()}
@@ -0,0 +1,113 @@
+import json
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.renderers import JSONRenderer
+
+from api.metrics import count_cache
+
+
+def get_version(name, timeout=None):
+    """Текущая версия данных; новая версия никогда не повторяет старую.
+
+    Потерянная версия, по таймауту или вытеснением, безопасна: на её
+    место встаёт новая, и старые ключи просто перестают читаться.
+    """
+    key = f'{name}:version'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name, timeout=None):
+    cache.set(f'{name}:version', time.time_ns(), timeout)
+
+
+def etag_matches(request, etag):
+    return etag in parse_etags(request.headers.get('If-None-Match', ''))
+
+
+class VersionedCacheListMixin:
+    """Список, закэшированный готовым JSON под ключом версии.
+
+    Версию меняют сигналы при изменении данных, поэтому старые ключи
+    просто перестают читаться и удаляются по VERSIONED_LIST_CACHE_TTL. ETag совпадает с версией, и на
+    повторный запрос клиента отвечаем 304 без обращения к БД.
+    """
+
+    cache_name = None
+
+    def cached_list(self, request):
+        version = get_version(self.cache_name)
+        etag = quote_etag(f'{self.cache_name}-{version}')
+        if etag_matches(request, etag):
+            return HttpResponseNotModified(headers={'ETag': etag})
+        key = f'{self.cache_name}:{version}:list'
+        content = cache.get(key)
+        count_cache(f'{self.cache_name}:list', content is not None)
+        if content is None:
+            serializer = self.get_serializer(self.get_queryset(), many=True)
+            content = JSONRenderer().render(serializer.data)
+            cache.set(key, content, settings.VERSIONED_LIST_CACHE_TTL)
+        response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_list(request)
+
+
+class AnonymousListCacheMixin:
+    """Страницы списка для анонимов, закэшированные готовым JSON.
+
+    Ключ — версия данных, адрес сайта и отсортированные параметры
+    запроса. Версию меняют сигналы, поэтому устаревшие страницы
+    перестают читаться сразу после изменения данных.
+    """
+
+    cache_name = None
+
+    def anonymous_cache_key(self, request):
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            for value in values
+        )
+        raw = json.dumps([request.build_absolute_uri('/'), params])
+        return '{}:{}:page:{}'.format(
+            self.cache_name,
+            get_version(self.cache_name),
+            md5(raw.encode()).hexdigest(),
+        )
+
+    def list(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        key = self.anonymous_cache_key(request)
+        cached = cache.get(key)
+        hit = cached is not None
+        count_cache(f'{self.cache_name}:page', hit)
+        if not hit:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cached = (
+                JSONRenderer().render(response.data),
+                response.get('X-Count-Strategy'),
+            )
+            cache.set(key, cached, settings.ANONYMOUS_PAGE_CACHE_TTL)
+        content, count_strategy = cached
+        response = HttpResponse(content, content_type='application/json')
+        if count_strategy:
+            response['X-Count-Strategy'] = count_strategy
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        patch_vary_headers(response, ('Authorization',))
+        return response
@@ -0,0 +1,83 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Первичный ключ, объекты для которого загружаются одним запросом.
+
+    После resolve() ключи ищутся среди заранее загруженных объектов,
+    без запроса на каждый. Со many=True список разрешается сам, а во
+    вложенном списке это делает BulkRelatedListSerializer.
+    """
+
+    resolved = None
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_pk(self, value):
+        if isinstance(value, bool):
+            raise TypeError
+        return self.get_queryset().model._meta.pk.to_python(value)
+
+    def resolve(self, values):
+        """Загрузка всех объектов списка одним запросом id__in."""
+        pks = set()
+        for value in values:
+            try:
+                pks.add(self.to_pk(value))
+            except (DjangoValidationError, TypeError):
+                continue
+        self.resolved = self.get_queryset().in_bulk(pks)
+
+    def to_internal_value(self, data):
+        if self.resolved is None:
+            return super().to_internal_value(data)
+        try:
+            pk = self.to_pk(data)
+        except (DjangoValidationError, TypeError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in self.resolved:
+            self.fail('does_not_exist', pk_value=data)
+        return self.resolved[pk]
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Список первичных ключей, проверяемый одним запросом."""
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str) and hasattr(data, '__iter__'):
+            data = list(data)
+            self.child_relation.resolve(data)
+        return super().to_internal_value(data)
+
+
+class BulkRelatedListSerializer(serializers.ListSerializer):
+    """Вложенный список, где ключи поля bulk_field разрешаются разом."""
+
+    bulk_field = 'id'
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.child.fields[self.bulk_field].resolve(
+                item[self.bulk_field] for item in data
+                if isinstance(item, dict) and self.bulk_field in item
+            )
+        return super().to_internal_value(data)
+
+
+def find_duplicates(values):
+    """Значения, встречающиеся больше одного раза, в порядке появления."""
+    seen = set()
+    duplicates = {}
+    for value in values:
+        if value in seen:
+            duplicates[value] = None
+        seen.add(value)
+    return list(duplicates)
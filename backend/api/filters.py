@@ -29,6 +29,7 @@ class RecipeFilter(FilterSet):
     is_favorited = django_filters.CharFilter(method='get_favorite')
     is_in_shopping_cart = django_filters.CharFilter(
         method='filter_queryset_cart')
+    search = django_filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
@@ -36,11 +37,15 @@ class RecipeFilter(FilterSet):
             'tags',
             'author',
             'is_favorited',
-            'is_in_shopping_cart'
+            'is_in_shopping_cart',
+            'search',
         )
 
     def filter_queryset(self, queryset):
         request = self.request
+        search = request.query_params.get('search')
+        if search:
+            queryset = queryset.search(search)
         tags = request.query_params.get('tags')
         if tags:
             queryset = queryset.filter(tags__slug=tags)
@@ -0,0 +1,144 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from api.cache import bump_version
+from foodgram.models import Recipe
+from users.constaints import IMAGE_VARIANT_SIZES
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'foodgram/variants'
+FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True,
+                             'progressive': True}),
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+}
+
+executor = ThreadPoolExecutor(
+    max_workers=max(settings.IMAGE_WORKERS, 1),
+    thread_name_prefix='recipe-images',
+)
+
+
+def flatten(image):
+    """Изображение без прозрачности на белом фоне, для JPEG."""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def encode(image, image_format):
+    pil_format, _, options = FORMATS[image_format]
+    if pil_format == 'JPEG':
+        image = flatten(image)
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def make_variants(name):
+    """Уменьшенные копии изображения во всех размерах и форматах.
+
+    Размеры идут от большего к меньшему, и каждый следующий
+    получается из предыдущего, а не из исходного снимка.
+    """
+    stem = PurePosixPath(name).stem
+    variants = {'source': name}
+    with default_storage.open(name) as image_file:
+        image = ImageOps.exif_transpose(Image.open(image_file))
+        image.load()
+    for size_name, size in sorted(
+        IMAGE_VARIANT_SIZES.items(), key=lambda item: -item[1]
+    ):
+        image = image.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+        variants[size_name] = {
+            image_format: default_storage.save(
+                f'{VARIANTS_DIR}/{stem}-{size_name}.{extension}',
+                ContentFile(encode(image, image_format)),
+            )
+            for image_format, (_, extension, _) in FORMATS.items()
+        }
+    return variants
+
+
+def image_names(image, variants):
+    """Файлы изображения рецепта: исходный и его копии."""
+    if image:
+        yield image
+    for size_name in IMAGE_VARIANT_SIZES:
+        yield from (variants or {}).get(size_name, {}).values()
+
+
+def release_images(names):
+    """Отпустить файлы; при хранении по хешу это уменьшает их счётчики."""
+    for name in names:
+        default_storage.delete(name)
+
+
+def process_recipe_image(recipe_id):
+    """Варианты изображения рецепта; устаревший результат не пишется.
+
+    Запись сравнивает и изображение, и прежние варианты: из двух
+    параллельных задач для одного рецепта пишет только первая, а
+    вторая отпускает лишь созданные ею файлы.
+    """
+    try:
+        name, old_variants = Recipe.objects.filter(pk=recipe_id).values_list(
+            'image', 'image_variants'
+        ).first() or (None, None)
+        if not name or old_variants.get('source') == name:
+            return
+        variants = make_variants(name)
+        updated = Recipe.objects.filter(
+            pk=recipe_id, image=name, image_variants=old_variants
+        ).update(image_variants=variants, updated_at=timezone.now())
+        release_images(image_names(
+            None, old_variants if updated else variants
+        ))
+        if updated:
+            bump_version('recipes')
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_recipe_image(recipe_id):
+    """Обработка изображения в фоне после фиксации транзакции."""
+    if settings.IMAGE_WORKERS:
+        transaction.on_commit(
+            lambda: executor.submit(process_recipe_image, recipe_id)
+        )
+    else:
+        transaction.on_commit(lambda: process_recipe_image(recipe_id))
+
+
+def variant_urls(recipe, request=None):
+    """Ссылки на готовые варианты или None, пока их нет."""
+    variants = recipe.image_variants
+    if not variants or variants.get('source') != recipe.image.name:
+        return None
+    urls = {}
+    for size_name in IMAGE_VARIANT_SIZES:
+        urls[size_name] = {}
+        for image_format, name in variants[size_name].items():
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[size_name][image_format] = url
+    return urls
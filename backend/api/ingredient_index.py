@@ -0,0 +1,167 @@
+import bisect
+import mmap
+import os
+import struct
+
+from django.conf import settings
+
+from foodgram.models import Ingredient
+
+INDEX_MAGIC = b'FGIDX1'
+HEADER = struct.Struct('<6sI')
+OFFSET = struct.Struct('<I')
+FIELD_SEPARATOR = b'\x1f'
+
+
+def normalize(name):
+    """Приведение названия к виду для поиска: регистр и ё/е."""
+    return name.strip().casefold().replace('ё', 'е')
+
+
+def build_index(path):
+    """Записывает индекс ингредиентов в файл.
+
+    Формат файла: заголовок, таблица смещений записей и сами записи
+    ``ключ\\x1fid\\x1fназвание\\x1fединица\\n``, отсортированные
+    по нормализованному названию. Файл подменяется атомарно, поэтому
+    воркеры, уже открывшие старую версию, дочитывают её без ошибок.
+    """
+    records = sorted(
+        (
+            FIELD_SEPARATOR.join((
+                normalize(name).encode(),
+                str(pk).encode(),
+                name.encode(),
+                measurement_unit.encode(),
+            )) + b'\n'
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).iterator()
+        )
+    )
+    offsets = [0]
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as index_file:
+        index_file.write(HEADER.pack(INDEX_MAGIC, len(records)))
+        for offset in offsets:
+            index_file.write(OFFSET.pack(offset))
+        index_file.writelines(records)
+    os.replace(tmp_path, path)
+
+
+class _Keys:
+    """Последовательность ключей индекса для bisect."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.count
+
+    def __getitem__(self, position):
+        return self.index.record(position)[0]
+
+
+class IngredientIndex:
+    """Поиск ингредиентов по началу и по вхождению без запросов в БД.
+
+    Индекс хранится в файле, который каждый воркер отображает в память;
+    страницы файла общие для всех процессов. Перед поиском проверяется,
+    не был ли файл пересобран, и при необходимости он переоткрывается.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mm = None
+        self.stamp = None
+        self.count = 0
+        self.data_start = 0
+
+    def rebuild(self):
+        build_index(self.path)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _open(self):
+        stamp = self._stat()
+        if stamp is None:
+            self.rebuild()
+            stamp = self._stat()
+        if stamp == self.stamp:
+            return
+        with open(self.path, 'rb') as index_file:
+            mm = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(mm)
+        if magic != INDEX_MAGIC:
+            mm.close()
+            raise ValueError(f'{self.path} не является индексом ингредиентов')
+        if self.mm is not None:
+            self.mm.close()
+        self.mm = mm
+        self.stamp = stamp
+        self.count = count
+        self.data_start = HEADER.size + OFFSET.size * (count + 1)
+
+    def _offset(self, position):
+        return self.data_start + OFFSET.unpack_from(
+            self.mm, HEADER.size + OFFSET.size * position
+        )[0]
+
+    def record(self, position):
+        start = self._offset(position)
+        end = self._offset(position + 1) - 1
+        return self.mm[start:end].split(FIELD_SEPARATOR)
+
+    def _position(self, offset):
+        """Номер записи, в которую попадает смещение в файле."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._offset(mid + 1) <= offset:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    @staticmethod
+    def _as_dict(record):
+        _, pk, name, measurement_unit = record
+        return {
+            'id': int(pk),
+            'name': name.decode(),
+            'measurement_unit': measurement_unit.decode(),
+        }
+
+    def search(self, query):
+        """Сначала совпадения по началу названия, затем по вхождению."""
+        self._open()
+        needle = normalize(query).encode()
+        if not needle or FIELD_SEPARATOR in needle or b'\n' in needle:
+            return []
+        results = []
+        position = bisect.bisect_left(_Keys(self), needle)
+        while position < self.count:
+            record = self.record(position)
+            if not record[0].startswith(needle):
+                break
+            results.append(self._as_dict(record))
+            position += 1
+        found = self.mm.find(needle, self.data_start)
+        while found != -1:
+            position = self._position(found)
+            record = self.record(position)
+            key_start = self._offset(position)
+            if key_start < found <= key_start + len(record[0]) - len(needle):
+                results.append(self._as_dict(record))
+            found = self.mm.find(needle, self._offset(position + 1))
+        return results
+
+
+ingredient_index = IngredientIndex(settings.INGREDIENT_INDEX_PATH)
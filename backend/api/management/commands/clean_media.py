@@ -0,0 +1,126 @@
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from foodgram.models import ImageBlob, Recipe
+
+CHUNK_SIZE = 2000
+
+
+def walk(root, relative=''):
+    """Файлы в том же порядке, что пути при ORDER BY ... COLLATE "C".
+
+    К имени каталога при сортировке добавляется «/», поэтому обход в
+    глубину идёт строго по возрастанию полного пути. В памяти держится
+    только содержимое текущего каталога.
+    """
+    with os.scandir(os.path.join(root, relative)) as entries:
+        entries = sorted(
+            entries,
+            key=lambda entry: entry.name + (
+                '/' if entry.is_dir(follow_symlinks=False) else ''
+            ),
+        )
+    for entry in entries:
+        path = relative + entry.name
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk(root, path + '/')
+        elif entry.is_file(follow_symlinks=False):
+            yield path, entry
+
+
+def referenced_names():
+    """Пути файлов, на которые ссылается БД, по возрастанию.
+
+    Читаются курсором на стороне сервера порциями по CHUNK_SIZE:
+    изображения рецептов, их уменьшенные копии и все файлы ImageBlob
+    (ими, даже без ссылок, занимается команда media_blobs).
+    """
+    recipes = Recipe._meta.db_table
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(
+            f'SELECT name FROM ('
+            f'SELECT image AS name FROM {recipes} WHERE image <> \'\' '
+            f'UNION SELECT jsonb_path_query(image_variants, \'$.*.*\') '
+            f'#>> \'{{}}\' FROM {recipes} '
+            f'UNION SELECT name FROM {ImageBlob._meta.db_table}'
+            f') names ORDER BY name COLLATE "C"'
+        )
+        while True:
+            rows = cursor.fetchmany(CHUNK_SIZE)
+            if not rows:
+                return
+            for (name,) in rows:
+                yield name
+
+
+class Command(BaseCommand):
+    help = 'Поиск и удаление файлов в MEDIA_ROOT, на которые нет ссылок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours',
+            type=float,
+            default=24,
+            help='Не трогать файлы моложе этого срока.',
+        )
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument(
+            '--delete',
+            action='store_true',
+            help='Удалить найденные файлы.',
+        )
+        action.add_argument(
+            '--quarantine',
+            help='Перенести найденные файлы в этот каталог.',
+        )
+
+    def orphans(self, root, skip, deadline):
+        """Файлы без ссылок старше deadline: слияние путей с диска и из БД."""
+        names = referenced_names()
+        name = next(names, None)
+        for path, entry in walk(root):
+            if skip and (path + '/').startswith(skip):
+                continue
+            while name is not None and name < path:
+                name = next(names, None)
+            if name == path:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime < deadline:
+                yield path, stat.st_size
+
+    def handle(self, *args, **options):
+        root = os.path.abspath(settings.MEDIA_ROOT)
+        if not os.path.isdir(root):
+            raise CommandError(f'Каталог {root} не найден.')
+        quarantine = options['quarantine']
+        skip = None
+        if quarantine:
+            quarantine = os.path.abspath(quarantine)
+            if (quarantine + os.sep).startswith(root + os.sep):
+                skip = os.path.relpath(quarantine, root) + '/'
+        deadline = time.time() - options['grace_hours'] * 3600
+        count = size = 0
+        for path, file_size in self.orphans(root, skip, deadline):
+            source = os.path.join(root, path)
+            if options['delete']:
+                os.remove(source)
+            elif quarantine:
+                target = os.path.join(quarantine, path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(source, target)
+            else:
+                self.stdout.write(f'{path} {file_size}')
+            count += 1
+            size += file_size
+        verb = 'Удалено' if options['delete'] else (
+            'Перенесено' if quarantine else 'Найдено'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} файлов без ссылок: {count}, {size} байт.'
+        ))
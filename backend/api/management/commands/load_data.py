@@ -1,16 +1,208 @@
+import csv
 import json
+import time
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
-from foodgram.models import Ingredient
+from api.cache import bump_version
+from api.ingredient_index import ingredient_index
+from foodgram.models import Ingredient, Recipe, Tag
+
+READ_CHUNK_SIZE = 64 * 1024
+MODELS = {
+    'ingredients': (Ingredient, ('name', 'measurement_unit'), 'name'),
+    'tags': (Tag, ('name', 'color', 'slug'), 'slug'),
+}
+RECIPE_LOOKUPS = {
+    'ingredients': 'ingredient_recipe__ingredient__name__in',
+    'tags': 'tags__slug__in',
+}
+
+
+def skip_separators(buffer, position):
+    while position < len(buffer) and buffer[position] in ' \t\r\n,':
+        position += 1
+    return position
+
+
+def iter_json_array(data_file):
+    """Объекты JSON-массива по одному, без чтения файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer = data_file.read(READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидался JSON-массив.')
+    position = 1
+    while True:
+        position = skip_separators(buffer, position)
+        if buffer.startswith(']', position):
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = data_file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                raise CommandError('Файл JSON обрывается или повреждён.')
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item
+
+
+def iter_csv_rows(data_file, fields):
+    for row in csv.reader(data_file):
+        if row:
+            yield dict(zip(fields, row))
+
+
+def batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 class Command(BaseCommand):
+    help = 'Загрузка ингредиентов или тегов из JSON или CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            choices=MODELS,
+            default='ingredients',
+            help='Что загружать.',
+        )
+        parser.add_argument(
+            '--path',
+            help='Файл с данными, по умолчанию data/<model>.json.',
+        )
+        parser.add_argument(
+            '--format',
+            choices=('json', 'csv'),
+            help='Формат файла, по умолчанию по расширению.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько строк записывать одним запросом.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Показать новые и изменённые записи, ничего не меняя.',
+        )
+
+    def read_items(self, path, file_format, fields):
+        with open(path, encoding='utf-8', newline='') as data_file:
+            if file_format == 'csv':
+                items = iter_csv_rows(data_file, fields)
+            else:
+                items = iter_json_array(data_file)
+            for number, item in enumerate(items, start=1):
+                missing = [field for field in fields if not item.get(field)]
+                if missing:
+                    raise CommandError(
+                        f'Запись {number}: нет полей {", ".join(missing)}.'
+                    )
+                yield {field: item[field].strip() for field in fields}
+
+    def diff_batch(self, model, fields, key, batch):
+        """Новые и изменённые записи пачки; совпадающие с БД отбрасываются."""
+        existing = {
+            getattr(obj, key): obj
+            for obj in model.objects.filter(
+                **{f'{key}__in': [item[key] for item in batch]}
+            )
+        }
+        created, updated = [], []
+        for item in batch:
+            obj = existing.get(item[key])
+            if obj is None:
+                created.append(item)
+            elif any(getattr(obj, field) != item[field] for field in fields):
+                updated.append(item)
+        return created, updated
+
+    def show_batch(self, created, updated):
+        for item in created:
+            self.stdout.write(f'+ {item}')
+        for item in updated:
+            self.stdout.write(f'~ {item}')
+
+    def save_batch(self, model_name, created, updated):
+        """Запись пачки и отметка рецептов с изменёнными записями."""
+        model, fields, key = MODELS[model_name]
+        if not created and not updated:
+            return
+        model.objects.bulk_create(
+            [model(**item) for item in created + updated],
+            update_conflicts=True,
+            unique_fields=[key],
+            update_fields=[field for field in fields if field != key],
+        )
+        # У новых записей ещё нет рецептов.
+        if updated:
+            Recipe.objects.filter(**{
+                RECIPE_LOOKUPS[model_name]: [item[key] for item in updated]
+            }).touch()
+
     def handle(self, *args, **options):
-        self.stdout.write(self.style.WARNING('Старт команды'))
-        with open('data/ingredients.json', encoding='utf-8',
-                  ) as data_file_ingredients:
-            ingredient_data = json.loads(data_file_ingredients.read())
-            for ingredients in ingredient_data:
-                Ingredient.objects.get_or_create(**ingredients)
-        self.stdout.write(self.style.SUCCESS('Ингредиенты загружены в бд!'))
+        model, fields, key = MODELS[options['model']]
+        path = Path(options['path'] or (
+            settings.BASE_DIR / 'data' / f'{options["model"]}.json'
+        ))
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден.')
+        file_format = options['format'] or path.suffix.lstrip('.')
+        if file_format not in ('json', 'csv'):
+            raise CommandError('Укажите --format json или csv.')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
+        dry_run = options['dry_run']
+        self.stdout.write(self.style.WARNING(f'Старт команды: {path}'))
+        started = time.monotonic()
+        total = created = updated = 0
+        items = self.read_items(path, file_format, fields)
+        with transaction.atomic():
+            for batch in batches(items, batch_size):
+                batch = list({item[key]: item for item in batch}.values())
+                batch_created, batch_updated = self.diff_batch(
+                    model, fields, key, batch
+                )
+                created += len(batch_created)
+                updated += len(batch_updated)
+                if dry_run:
+                    self.show_batch(batch_created, batch_updated)
+                else:
+                    self.save_batch(
+                        options['model'], batch_created, batch_updated
+                    )
+                total += len(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'{total} строк, {total / elapsed:.0f} строк/с'
+                )
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f'Проверено {total}: новых {created}, изменённых {updated}.'
+            ))
+            return
+        if created or updated:
+            if model is Ingredient:
+                ingredient_index.rebuild()
+            bump_version(options['model'])
+        if updated:
+            bump_version('recipes')
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено {total} записей за '
+            f'{time.monotonic() - started:.1f} с: новых {created}, '
+            f'изменённых {updated}.'
+        ))
@@ -0,0 +1,81 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from foodgram.models import ImageBlob
+from foodgram.storage import ContentAddressedStorage
+
+CHUNK_SIZE = 1000
+
+
+def format_size(size):
+    if size < 1024 * 1024:
+        return f'{size / 1024:.1f} КБ'
+    return f'{size / 1024 / 1024:.1f} МБ'
+
+
+class Command(BaseCommand):
+    help = 'Отчёт о файлах изображений и удаление файлов без ссылок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reclaim',
+            action='store_true',
+            help='Удалить файлы, на которые не осталось ссылок.',
+        )
+
+    def report(self):
+        stats = ImageBlob.objects.aggregate(
+            files=Count('name'),
+            stored=Sum('size', default=0),
+            logical=Sum(F('size') * F('refs'), default=0),
+            unreferenced=Count('name', filter=Q(refs=0)),
+            unreferenced_size=Sum('size', filter=Q(refs=0), default=0),
+        )
+        saved = stats['logical'] - stats['stored'] + stats['unreferenced_size']
+        self.stdout.write(
+            f'Файлов: {stats["files"]}, занято {format_size(stats["stored"])}.'
+        )
+        self.stdout.write(
+            f'Без повторов заняло бы {format_size(stats["logical"])}, '
+            f'сэкономлено {format_size(max(saved, 0))}.'
+        )
+        self.stdout.write(
+            f'Без ссылок: {stats["unreferenced"]} файлов, '
+            f'{format_size(stats["unreferenced_size"])}.'
+        )
+
+    def reclaim(self):
+        """Удаление по одному файлу: строка блокируется до удаления файла.
+
+        Загрузка того же файла в это время ждёт блокировку и после
+        фиксации создаёт новую строку и записывает файл заново.
+        """
+        names = ImageBlob.objects.filter(refs=0).values_list(
+            'name', flat=True
+        )
+        count = size = 0
+        for name in names.iterator(chunk_size=CHUNK_SIZE):
+            with transaction.atomic():
+                blob = ImageBlob.objects.select_for_update().filter(
+                    name=name, refs=0
+                ).first()
+                if blob is None:
+                    continue
+                blob.delete()
+                default_storage.reclaim(name)
+            count += 1
+            size += blob.size
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено файлов: {count}, освобождено {format_size(size)}.'
+        ))
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError(
+                'Хранилище по умолчанию не ContentAddressedStorage.'
+            )
+        self.report()
+        if options['reclaim']:
+            self.reclaim()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from api.images import process_recipe_image
+from foodgram.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Уменьшенные копии изображений рецептов, у которых их нет.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересоздать копии для всех рецептов.',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        total = 0
+        for recipe_id in recipes.values_list('pk', flat=True).iterator():
+            process_recipe_image(recipe_id)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(f'Обработано рецептов: {total}.'))
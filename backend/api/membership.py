@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+
+from api.cache import bump_version, get_version
+from api.metrics import count_cache
+from foodgram.models import Favorite, ShoppingList
+from users.models import FollowUser
+
+KINDS = {
+    'favorites': (Favorite, 'author_id', 'recipe_id'),
+    'cart': (ShoppingList, 'author_id', 'recipe_id'),
+    'following': (FollowUser, 'user_id', 'author_id'),
+}
+
+
+def cache_key(kind, user_id):
+    return f'membership:{kind}:{user_id}'
+
+
+def invalidate(kind, user_id):
+    """Сброс закэшированного множества после записи в БД.
+
+    Новая версия отбрасывает и множество, которое параллельный запрос
+    прочитал из БД до записи, но положит в кэш уже после сброса.
+    """
+    ttl = settings.MEMBERSHIP_CACHE_TTL
+    if ttl:
+        key = cache_key(kind, user_id)
+        bump_version(key, ttl)
+        cache.delete(key)
+
+
+class Membership:
+    """Избранное, корзина и подписки пользователя множествами id.
+
+    Каждое множество читается одним запросом при первом обращении и
+    живёт до конца запроса. При MEMBERSHIP_CACHE_TTL множества берутся
+    из кэша, а сигналы сбрасывают их при изменении Favorite,
+    ShoppingList и FollowUser. Множество в кэше помечено версией,
+    прочитанной до запроса к БД, и читается, только пока версия
+    не сменилась.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def load(self, kind):
+        if not self.user.is_authenticated:
+            return frozenset()
+        ttl = settings.MEMBERSHIP_CACHE_TTL
+        key = cache_key(kind, self.user.pk)
+        if ttl:
+            version_key = f'{key}:version'
+            cached = cache.get_many([version_key, key])
+            version = cached.get(version_key) or get_version(key, ttl)
+            entry = cached.get(key)
+            hit = isinstance(entry, tuple) and entry[0] == version
+            count_cache('membership', hit)
+            if hit:
+                return frozenset(entry[1])
+        model, user_field, id_field = KINDS[kind]
+        ids = frozenset(model.objects.filter(
+            **{user_field: self.user.pk}
+        ).values_list(id_field, flat=True))
+        if ttl:
+            cache.set(key, (version, list(ids)), ttl)
+        return ids
+
+    @cached_property
+    def favorites(self):
+        return self.load('favorites')
+
+    @cached_property
+    def cart(self):
+        return self.load('cart')
+
+    @cached_property
+    def following(self):
+        return self.load('following')
+
+    def is_favorited(self, recipe_id):
+        return recipe_id in self.favorites
+
+    def is_in_shopping_cart(self, recipe_id):
+        return recipe_id in self.cart
+
+    def is_subscribed(self, author_id):
+        return author_id in self.following
+
+
+def get_membership(request):
+    """Сервис членства, один на HTTP-запрос."""
+    http_request = getattr(request, '_request', request)
+    membership = getattr(http_request, 'membership', None)
+    if membership is None:
+        membership = http_request.membership = Membership(request.user)
+    return membership
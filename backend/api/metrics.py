@@ -0,0 +1,113 @@
+import os
+import socket
+import time
+from collections import defaultdict
+
+from django.http import HttpResponse
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+
+REQUESTS = Counter(
+    'foodgram_requests',
+    'Ответы API по маршруту, методу и статусу.',
+    ['route', 'method', 'status'],
+)
+REQUEST_DURATION = Histogram(
+    'foodgram_request_duration_seconds',
+    'Время ответа по маршруту.',
+    ['route', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_DB_QUERIES = Histogram(
+    'foodgram_request_db_queries',
+    'Число запросов к БД на один ответ.',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+REQUEST_DB_DURATION = Histogram(
+    'foodgram_request_db_duration_seconds',
+    'Время запросов к БД на один ответ.',
+    ['route'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+CACHE_REQUESTS = Counter(
+    'foodgram_cache_requests',
+    'Обращения к кэшам: попадания и промахи.',
+    ['cache', 'result'],
+)
+WORKER_STARTED = Gauge(
+    'foodgram_worker_start_time_seconds',
+    'Время запуска процесса-воркера.',
+    ['worker'],
+    multiprocess_mode='liveall',
+)
+WORKER_STARTED.labels(f'{socket.gethostname()}:{os.getpid()}').set(
+    time.time()
+)
+
+
+def count_cache(name, hit, count=1):
+    if count:
+        CACHE_REQUESTS.labels(name, 'hit' if hit else 'miss').inc(count)
+
+
+def observe_request(request, response, performance):
+    """Запись времени ответа и запросов к БД по имени маршрута.
+
+    Маршрут берётся из имени URL роутера DRF (recipes-list,
+    users-subscriptions), а не из пути, чтобы число рядов не росло.
+    """
+    match = request.resolver_match
+    route = match.url_name if match and match.url_name else 'unmatched'
+    REQUESTS.labels(route, request.method, response.status_code).inc()
+    REQUEST_DURATION.labels(route, request.method).observe(
+        performance.total_time
+    )
+    REQUEST_DB_QUERIES.labels(route).observe(len(performance.queries))
+    REQUEST_DB_DURATION.labels(route).observe(performance.db_time)
+
+
+class CacheHitRatioCollector:
+    """Метрики источника и доля попаданий по каждому кэшу."""
+
+    def __init__(self, source):
+        self.source = source
+
+    def collect(self):
+        counts = defaultdict(lambda: {'hit': 0, 'miss': 0})
+        for metric in self.source.collect():
+            if metric.name == 'foodgram_cache_requests':
+                for sample in metric.samples:
+                    if sample.name.endswith('_total'):
+                        cache = counts[sample.labels['cache']]
+                        cache[sample.labels['result']] += sample.value
+            yield metric
+        ratio = GaugeMetricFamily(
+            'foodgram_cache_hit_ratio',
+            'Доля попаданий в кэш с запуска воркеров.',
+            labels=['cache'],
+        )
+        for name, cache in sorted(counts.items()):
+            total = cache['hit'] + cache['miss']
+            ratio.add_metric([name], cache['hit'] / total if total else 0)
+        yield ratio
+
+
+def metrics_view(request):
+    """Метрики в текстовом формате Prometheus.
+
+    Под gunicorn с PROMETHEUS_MULTIPROC_DIR значения каждого воркера
+    пишутся в свой файл, а здесь суммируются по всем воркерам.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        source = CollectorRegistry()
+        multiprocess.MultiProcessCollector(source)
+    else:
+        source = REGISTRY
+    registry = CollectorRegistry()
+    registry.register(CacheHitRatioCollector(source))
+    return HttpResponse(
+        generate_latest(registry), content_type=CONTENT_TYPE_LATEST
+    )
@@ -0,0 +1,156 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+from api.metrics import observe_request
+
+logger = logging.getLogger(__name__)
+
+IN_LIST = re.compile(r'\(%s(?:, %s)+\)')
+NUMBER = re.compile(r'\b\d+\b')
+
+
+def normalize_sql(sql):
+    """Запрос без значений: повторы с разными id и списками совпадают."""
+    return NUMBER.sub('?', IN_LIST.sub('(%s, ...)', sql))
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 1)
+
+
+class RequestMetrics:
+    """Время и запросы к БД одного HTTP-запроса.
+
+    Объект сам служит обёрткой connection.execute_wrapper: на каждый
+    запрос к БД приходится замер времени и добавление в список.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []
+        self.db_time = 0
+        self.view_started = self.view_finished = None
+        self.view_db_time = 0
+        self.render_time = 0
+        self.total_time = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.db_time += duration
+            self.queries.append((sql, duration))
+
+    def start_view(self):
+        self.view_started = time.perf_counter()
+        self.view_db_time = self.db_time
+
+    def finish_view(self):
+        if self.view_started is None or self.view_finished is not None:
+            return
+        self.view_finished = time.perf_counter()
+        self.view_db_time = self.db_time - self.view_db_time
+
+    @property
+    def app_time(self):
+        """Время вьюхи и сериализаторов без запросов к БД."""
+        if self.view_finished is None:
+            return 0
+        return self.view_finished - self.view_started - self.view_db_time
+
+    def duplicates(self, threshold):
+        """Запросы, повторённые не меньше threshold раз: признак N+1."""
+        counts = Counter()
+        for sql, count in Counter(sql for sql, _ in self.queries).items():
+            counts[normalize_sql(sql)] += count
+        return [
+            (sql, count) for sql, count in counts.most_common()
+            if count >= threshold
+        ]
+
+    def server_timing(self):
+        return ', '.join((
+            f'db;dur={milliseconds(self.db_time)};'
+            f'desc="{len(self.queries)} queries"',
+            f'app;dur={milliseconds(self.app_time)}',
+            f'render;dur={milliseconds(self.render_time)}',
+            f'total;dur={milliseconds(self.total_time)}',
+        ))
+
+
+class PerformanceMiddleware:
+    """Замер запросов к БД, работы вьюхи и рендеринга ответа.
+
+    Итог уходит в заголовок Server-Timing и строкой JSON в лог.
+    Повторяющиеся запросы отмечаются как N+1, а для медленных
+    запросов в лог выводится весь список SQL. Должна стоять первой
+    в MIDDLEWARE, чтобы замерять и остальные прослойки.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = request.performance = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            response = self.get_response(request)
+        metrics.finish_view()
+        metrics.total_time = time.perf_counter() - metrics.started
+        response['Server-Timing'] = metrics.server_timing()
+        self.log(request, response, metrics)
+        observe_request(request, response, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.performance.start_view()
+
+    def process_template_response(self, request, response):
+        metrics = request.performance
+        metrics.finish_view()
+        render_started = time.perf_counter()
+
+        def rendered(response):
+            metrics.render_time = time.perf_counter() - render_started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def log(self, request, response, metrics):
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'route': match.view_name if match else None,
+            'status': response.status_code,
+            'queries': len(metrics.queries),
+            'db_ms': milliseconds(metrics.db_time),
+            'app_ms': milliseconds(metrics.app_time),
+            'render_ms': milliseconds(metrics.render_time),
+            'total_ms': milliseconds(metrics.total_time),
+        }
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record, ensure_ascii=False))
+        for sql, count in metrics.duplicates(
+            settings.DUPLICATE_QUERY_THRESHOLD
+        ):
+            logger.warning(json.dumps(
+                {**record, 'event': 'duplicate_queries',
+                 'count': count, 'sql': sql},
+                ensure_ascii=False,
+            ))
+        if record['total_ms'] >= settings.SLOW_REQUEST_THRESHOLD_MS:
+            logger.warning(json.dumps(
+                {**record, 'event': 'slow_request', 'sql': [
+                    {'sql': sql, 'ms': milliseconds(duration)}
+                    for sql, duration in metrics.queries
+                ]},
+                ensure_ascii=False,
+            ))
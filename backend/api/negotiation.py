@@ -0,0 +1,8 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class IgnoreFormatContentNegotiation(DefaultContentNegotiation):
+    """Параметр format задаёт формат файла, а не рендерер ответа."""
+
+    def filter_renderers(self, renderers, format):
+        return renderers
@@ -1,7 +1,237 @@
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from api.metrics import count_cache
+
+USER_SCOPED_PARAMS = ('is_favorited', 'is_in_shopping_cart')
 
 
 class Pagination(PageNumberPagination):
-    """Кастомная пагинация для Рецептов и Пользователей."""
+    """Кастомная пагинация для Рецептов и Пользователей.
+
+    Страница выбирается со смещением и одной лишней строкой, по
+    которой решается, есть ли следующая. Число объектов нужно только
+    для поля count: оно берётся из короткоживущего кэша по параметрам
+    фильтрации, для больших выборок — из оценки планировщика, а на
+    последней странице считается по ней самой. Использованный способ
+    возвращается в заголовке X-Count-Strategy.
+    С параметром cursor (пустым для первой страницы) включается
+    постраничная навигация по ключу: следующая страница выбирается
+    условием на поля cursor_ordering вьюсета, без COUNT(*) и OFFSET.
+    """
     page_size_query_param = 'limit'
     page_size = 6
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = getattr(view, 'cursor_ordering', None)
+        self.use_cursor = bool(
+            self.ordering
+            and self.cursor_query_param in request.query_params
+        )
+        self.request = request
+        if not self.use_cursor:
+            return self.paginate_by_offset(queryset, request, view)
+        page_size = self.get_page_size(request)
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            queryset = queryset.filter(
+                self.after(self.decode(cursor, queryset.model))
+            )
+        page = list(queryset.order_by(*self.ordering)[:page_size + 1])
+        self.has_next = len(page) > page_size
+        self.page = page[:page_size]
+        return self.page
+
+    def paginate_by_offset(self, queryset, request, view):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        try:
+            number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            number = 0
+        if number < 1:
+            raise NotFound(self.invalid_page_message)
+        offset = (number - 1) * page_size
+        page = list(queryset[offset:offset + page_size + 1])
+        if not page and number > 1:
+            raise NotFound(self.invalid_page_message)
+        self.view = view
+        self.queryset = queryset
+        self.number = number
+        self.has_next = len(page) > page_size
+        self.page = page[:page_size]
+        if not self.has_next:
+            self.count_strategy, self.count = 'exact', offset + len(self.page)
+            cache.set(
+                self.count_cache_key(),
+                (self.count_strategy, self.count),
+                settings.PAGINATION_COUNT_CACHE_TTL,
+            )
+        else:
+            self.count_strategy = self.count = None
+        return self.page
+
+    def count_cache_key(self):
+        """Ключ кэша по нормализованным параметрам фильтрации.
+
+        Пользователь входит в ключ, только если выборка зависит от него:
+        подписки, избранное и корзина.
+        """
+        request = self.request
+        skip = (
+            self.page_query_param,
+            self.page_size_query_param,
+            self.cursor_query_param,
+        )
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            if key not in skip
+            for value in values
+        )
+        action = getattr(self.view, 'action', None)
+        scope = 'user' if request.user.is_authenticated else 'anon'
+        if request.user.is_authenticated and (
+            action == 'subscriptions'
+            or any(key in USER_SCOPED_PARAMS for key, _ in params)
+        ):
+            scope = f'user:{request.user.pk}'
+        raw = json.dumps([
+            getattr(self.view, 'basename', None), action, scope, params,
+        ])
+        return 'page-count:' + md5(raw.encode()).hexdigest()
+
+    def estimate_count(self, queryset):
+        """Оценка планировщика Postgres; None, если оценки нет."""
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+                return int(row[0]) if row and row[0] >= 0 else None
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def get_count(self, queryset):
+        """Способ подсчёта и число: из кэша, оценкой или точно."""
+        key = self.count_cache_key()
+        cached = cache.get(key)
+        count_cache('pagination:count', cached is not None)
+        if cached is not None:
+            return cached
+        count = self.estimate_count(queryset)
+        threshold = settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD
+        if count is not None and count > threshold:
+            result = ('estimated', count)
+        else:
+            result = ('exact', queryset.count())
+        cache.set(key, result, settings.PAGINATION_COUNT_CACHE_TTL)
+        return result
+
+    def decode(self, cursor, model):
+        """Значения курсора, приведённые к типам полей сортировки."""
+        try:
+            values = json.loads(b64decode(cursor.encode(), validate=True))
+            if (
+                not isinstance(values, list)
+                or len(values) != len(self.ordering)
+                or None in values
+            ):
+                raise ValueError
+            return [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (BinasciiError, ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode(self, obj):
+        values = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(value)
+        return b64encode(json.dumps(values).encode()).decode()
+
+    def after(self, values):
+        """Условие «строго после курсора» для составного ключа.
+
+        Лишнее условие на первое поле позволяет Postgres идти по
+        индексу диапазоном, а не склеивать ветки OR.
+        """
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        first = self.ordering[0]
+        bound = 'lte' if first.startswith('-') else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & condition
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        if not self.use_cursor:
+            return replace_query_param(
+                url, self.page_query_param, self.number + 1
+            )
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode(self.page[-1])
+        )
+
+    def get_previous_link(self):
+        if self.number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url, self.page_query_param, self.number - 1
+        )
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            if self.count is None:
+                self.count_strategy, self.count = self.get_count(
+                    self.queryset
+                )
+            response = Response({
+                'count': self.count,
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link(),
+                'results': data,
+            })
+            response['X-Count-Strategy'] = self.count_strategy
+            return response
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
@@ -0,0 +1,367 @@
+import struct
+
+# Таблицы, которые PDF требует от встроенного TrueType-шрифта.
+SUBSET_TABLES = (
+    b'cvt ', b'fpgm', b'glyf', b'head', b'hhea', b'hmtx', b'loca', b'maxp',
+    b'prep',
+)
+# Флаги компонента составного глифа.
+ARG_1_AND_2_ARE_WORDS = 0x0001
+WE_HAVE_A_SCALE = 0x0008
+MORE_COMPONENTS = 0x0020
+WE_HAVE_AN_X_AND_Y_SCALE = 0x0040
+WE_HAVE_A_TWO_BY_TWO = 0x0080
+
+
+def checksum(data):
+    data += b'\0' * (-len(data) % 4)
+    return sum(struct.unpack(f'>{len(data) // 4}I', data)) & 0xFFFFFFFF
+
+
+def components(glyph):
+    """Позиции номеров глифов-компонентов в данных составного глифа."""
+    if len(glyph) < 10 or struct.unpack_from('>h', glyph)[0] >= 0:
+        return
+    position = 10
+    while True:
+        flags = struct.unpack_from('>H', glyph, position)[0]
+        yield position + 2
+        position += 8 if flags & ARG_1_AND_2_ARE_WORDS else 6
+        if flags & WE_HAVE_A_SCALE:
+            position += 2
+        elif flags & WE_HAVE_AN_X_AND_Y_SCALE:
+            position += 4
+        elif flags & WE_HAVE_A_TWO_BY_TWO:
+            position += 8
+        if not flags & MORE_COMPONENTS:
+            return
+
+
+class TrueTypeFont:
+    """Моноширинный TrueType-шрифт: метрики и подмножество для PDF."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as font_file:
+            self.data = data = font_file.read()
+        num_tables = struct.unpack_from('>H', data, 4)[0]
+        self.tables = tables = {}
+        for position in range(12, 12 + num_tables * 16, 16):
+            tag, _, offset, length = struct.unpack_from(
+                '>4sIII', data, position
+            )
+            tables[tag] = (offset, length)
+        head = tables[b'head'][0]
+        hhea = tables[b'hhea'][0]
+        units_per_em = struct.unpack_from('>H', data, head + 18)[0]
+        scale = 1000 / units_per_em
+        self.bbox = [
+            round(value * scale)
+            for value in struct.unpack_from('>4h', data, head + 36)
+        ]
+        ascent, descent = struct.unpack_from('>2h', data, hhea + 4)
+        self.ascent = round(ascent * scale)
+        self.descent = round(descent * scale)
+        advance = struct.unpack_from('>H', data, tables[b'hmtx'][0])[0]
+        self.width = round(advance * scale)
+        self.glyphs = self._read_cmap(data, tables[b'cmap'][0])
+
+    @staticmethod
+    def _read_cmap(data, cmap):
+        """Таблица символ -> глиф из подтаблицы Unicode BMP формата 4."""
+        count = struct.unpack_from('>H', data, cmap + 2)[0]
+        for position in range(cmap + 4, cmap + 4 + count * 8, 8):
+            platform, encoding, offset = struct.unpack_from(
+                '>HHI', data, position
+            )
+            subtable = cmap + offset
+            if (platform, encoding) == (3, 1) and struct.unpack_from(
+                '>H', data, subtable
+            )[0] == 4:
+                break
+        else:
+            raise ValueError('В шрифте нет таблицы Unicode формата 4.')
+        segments = struct.unpack_from('>H', data, subtable + 6)[0] // 2
+        ends = subtable + 14
+        starts = ends + segments * 2 + 2
+        deltas = starts + segments * 2
+        range_offsets = deltas + segments * 2
+        glyphs = {}
+        for segment in range(segments):
+            end = struct.unpack_from('>H', data, ends + segment * 2)[0]
+            start = struct.unpack_from('>H', data, starts + segment * 2)[0]
+            delta = struct.unpack_from('>h', data, deltas + segment * 2)[0]
+            range_position = range_offsets + segment * 2
+            range_offset = struct.unpack_from('>H', data, range_position)[0]
+            for code in range(start, min(end, 0xFFFE) + 1):
+                if range_offset:
+                    glyph = struct.unpack_from(
+                        '>H', data,
+                        range_position + range_offset + (code - start) * 2
+                    )[0]
+                    if glyph:
+                        glyph = (glyph + delta) % 0x10000
+                else:
+                    glyph = (code + delta) % 0x10000
+                if glyph:
+                    glyphs[code] = glyph
+        return glyphs
+
+    def table(self, tag):
+        offset, length = self.tables[tag]
+        return self.data[offset:offset + length]
+
+    def subset(self, codes):
+        """Шрифт только с глифами символов codes и их компонентами.
+
+        Глифы перенумеровываются подряд, начиная с .notdef, и
+        возвращаются вместе с таблицей символ -> новый номер глифа.
+        """
+        head = bytearray(self.table(b'head'))
+        glyf = self.table(b'glyf')
+        num_glyphs = struct.unpack_from('>H', self.table(b'maxp'), 4)[0]
+        if struct.unpack_from('>h', head, 50)[0]:
+            loca = struct.unpack(
+                f'>{num_glyphs + 1}I', self.table(b'loca')
+            )
+        else:
+            loca = [offset * 2 for offset in struct.unpack(
+                f'>{num_glyphs + 1}H', self.table(b'loca')
+            )]
+        old_glyphs = [0]
+        old_glyphs.extend(sorted(
+            {self.glyphs[code] for code in codes if code in self.glyphs}
+        ))
+        numbers = {glyph: number for number, glyph in enumerate(old_glyphs)}
+        for glyph in old_glyphs:
+            for position in components(glyf[loca[glyph]:loca[glyph + 1]]):
+                component = struct.unpack_from(
+                    '>H', glyf, loca[glyph] + position
+                )[0]
+                if component not in numbers:
+                    numbers[component] = len(old_glyphs)
+                    old_glyphs.append(component)
+        hhea = bytearray(self.table(b'hhea'))
+        metrics_count = struct.unpack_from('>H', hhea, 34)[0]
+        hmtx = self.table(b'hmtx')
+        new_glyf = bytearray()
+        new_loca = []
+        new_hmtx = bytearray()
+        for glyph in old_glyphs:
+            new_loca.append(len(new_glyf))
+            data = bytearray(glyf[loca[glyph]:loca[glyph + 1]])
+            for position in components(data):
+                component = struct.unpack_from('>H', data, position)[0]
+                struct.pack_into('>H', data, position, numbers[component])
+            new_glyf += data + b'\0' * (-len(data) % 4)
+            if glyph < metrics_count:
+                new_hmtx += hmtx[glyph * 4:glyph * 4 + 4]
+            else:
+                new_hmtx += hmtx[metrics_count * 4 - 4:metrics_count * 4 - 2]
+                lsb = metrics_count * 4 + (glyph - metrics_count) * 2
+                new_hmtx += hmtx[lsb:lsb + 2]
+        new_loca.append(len(new_glyf))
+        struct.pack_into('>I', head, 8, 0)
+        struct.pack_into('>h', head, 50, 1)
+        struct.pack_into('>H', hhea, 34, len(old_glyphs))
+        maxp = bytearray(self.table(b'maxp'))
+        struct.pack_into('>H', maxp, 4, len(old_glyphs))
+        tables = {
+            tag: self.table(tag) for tag in SUBSET_TABLES
+            if tag in self.tables
+        }
+        tables.update({
+            b'glyf': bytes(new_glyf),
+            b'head': bytes(head),
+            b'hhea': bytes(hhea),
+            b'hmtx': bytes(new_hmtx),
+            b'loca': struct.pack(f'>{len(new_loca)}I', *new_loca),
+            b'maxp': bytes(maxp),
+        })
+        font, offsets = self._build(tables)
+        struct.pack_into(
+            '>I', font, offsets[b'head'] + 8,
+            (0xB1B0AFBA - checksum(bytes(font))) & 0xFFFFFFFF,
+        )
+        return bytes(font), {
+            code: numbers[self.glyphs[code]]
+            for code in codes if code in self.glyphs
+        }
+
+    @staticmethod
+    def _build(tables):
+        """Файл шрифта из таблиц и смещения таблиц в нём."""
+        count = len(tables)
+        power = 1 << (count.bit_length() - 1)
+        font = bytearray(struct.pack(
+            '>IHHHH', 0x00010000, count, power * 16,
+            power.bit_length() - 1, count * 16 - power * 16,
+        ))
+        offsets = {}
+        body = bytearray()
+        for tag, data in sorted(tables.items()):
+            offsets[tag] = 12 + count * 16 + len(body)
+            font += struct.pack(
+                '>4sIII', tag, checksum(data), offsets[tag], len(data)
+            )
+            body += data + b'\0' * (-len(data) % 4)
+        return font + body, offsets
+
+
+class StreamingPDF:
+    """Постраничная запись PDF с текстом в один столбец.
+
+    Страницы отдаются клиенту по мере заполнения, а объекты шрифта,
+    дерево страниц и таблица xref дописываются в конце файла, поэтому
+    в памяти одновременно держится только текущая страница.
+    Символы кодируются своими кодами Unicode (Identity-H), а
+    соответствие кодов глифам и шрифт только с нужными глифами
+    записываются после текста.
+    """
+
+    CATALOG, PAGES, FONT, CID_FONT, DESCRIPTOR, FONT_FILE = range(1, 7)
+    TO_UNICODE, CID_TO_GID = 7, 8
+    FIRST_PAGE = 9
+    PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+    MARGIN = 50
+    FONT_SIZE = 11
+    LEADING = 16
+
+    def __init__(self, font):
+        self.font = font
+        self.offsets = {}
+        self.position = 0
+        self.pages = []
+        self.used = set()
+        self.lines_per_page = (
+            (self.PAGE_HEIGHT - 2 * self.MARGIN) // self.LEADING
+        )
+        self.line_length = int(
+            (self.PAGE_WIDTH - 2 * self.MARGIN)
+            / (font.width * self.FONT_SIZE / 1000)
+        )
+
+    def _write(self, data):
+        self.position += len(data)
+        return data
+
+    def _object(self, number, body):
+        self.offsets[number] = self.position
+        return self._write(
+            b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        )
+
+    def _stream(self, number, content, extra=b''):
+        return self._object(
+            number,
+            b'<< /Length %d %s>>\nstream\n' % (len(content), extra)
+            + content + b'\nendstream'
+        )
+
+    def _encode(self, line):
+        codes = [ord(char) for char in line if ord(char) <= 0xFFFF]
+        self.used.update(codes)
+        return b'<' + ''.join('%04X' % code for code in codes).encode() + b'>'
+
+    def _wrap(self, lines):
+        for line in lines:
+            while len(line) > self.line_length:
+                yield line[:self.line_length]
+                line = '  ' + line[self.line_length:]
+            yield line
+
+    def _page(self, lines):
+        content = b'BT /F1 %d Tf %d TL %d %d Td\n' % (
+            self.FONT_SIZE, self.LEADING,
+            self.MARGIN, self.PAGE_HEIGHT - self.MARGIN,
+        ) + b''.join(
+            self._encode(line) + b" '\n" for line in lines
+        ) + b'ET'
+        number = self.FIRST_PAGE + 2 * len(self.pages)
+        self.pages.append(number)
+        return self._stream(number + 1, content) + self._object(
+            number,
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>' % (
+                self.PAGES, self.PAGE_WIDTH, self.PAGE_HEIGHT,
+                self.FONT, number + 1,
+            )
+        )
+
+    def _font_objects(self):
+        font = self.font
+        yield self._object(
+            self.FONT,
+            b'<< /Type /Font /Subtype /Type0 /BaseFont /Foodgram '
+            b'/Encoding /Identity-H /DescendantFonts [%d 0 R] '
+            b'/ToUnicode %d 0 R >>' % (self.CID_FONT, self.TO_UNICODE)
+        )
+        yield self._object(
+            self.CID_FONT,
+            b'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /Foodgram '
+            b'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) '
+            b'/Supplement 0 >> /FontDescriptor %d 0 R /DW %d '
+            b'/CIDToGIDMap %d 0 R >>' % (
+                self.DESCRIPTOR, font.width, self.CID_TO_GID,
+            )
+        )
+        yield self._object(
+            self.DESCRIPTOR,
+            b'<< /Type /FontDescriptor /FontName /Foodgram /Flags 33 '
+            b'/FontBBox [%d %d %d %d] /ItalicAngle 0 /Ascent %d '
+            b'/Descent %d /CapHeight %d /StemV 80 /FontFile2 %d 0 R >>' % (
+                *font.bbox, font.ascent, font.descent, font.ascent,
+                self.FONT_FILE,
+            )
+        )
+        font_file, glyphs = font.subset(self.used)
+        yield self._stream(
+            self.FONT_FILE, font_file, b'/Length1 %d ' % len(font_file)
+        )
+        yield self._stream(
+            self.TO_UNICODE,
+            b'/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n'
+            b'/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) '
+            b'/Supplement 0 >> def\n/CMapName /Foodgram-UCS def\n'
+            b'/CMapType 2 def\n1 begincodespacerange\n<0000> <FFFF>\n'
+            b'endcodespacerange\n1 beginbfrange\n<0000> <FFFF> <0000>\n'
+            b'endbfrange\nendcmap\nCMapName currentdict /CMap defineresource '
+            b'pop\nend\nend'
+        )
+        glyph_map = bytearray(2 * (max(self.used, default=0) + 1))
+        for code in self.used:
+            struct.pack_into('>H', glyph_map, 2 * code,
+                             glyphs.get(code, 0))
+        yield self._stream(self.CID_TO_GID, bytes(glyph_map))
+
+    def render(self, lines):
+        """Генератор байтов документа из итератора строк."""
+        yield self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        page = []
+        for line in self._wrap(lines):
+            page.append(line)
+            if len(page) == self.lines_per_page:
+                yield self._page(page)
+                page = []
+        if page or not self.pages:
+            yield self._page(page)
+        yield from self._font_objects()
+        yield self._object(
+            self.PAGES,
+            b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+                b' '.join(b'%d 0 R' % number for number in self.pages),
+                len(self.pages),
+            )
+        )
+        yield self._object(
+            self.CATALOG,
+            b'<< /Type /Catalog /Pages %d 0 R >>' % self.PAGES
+        )
+        size = max(self.offsets) + 1
+        xref = self.position
+        yield self._write(
+            b'xref\n0 %d\n0000000000 65535 f \n' % size + b''.join(
+                b'%010d 00000 n \n' % self.offsets[number]
+                for number in range(1, size)
+            ) + b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n'
+            b'%%%%EOF\n' % (size, self.CATALOG, xref)
+        )
@@ -1,14 +1,27 @@
 import django.contrib.auth.password_validation as validators
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
-from foodgram.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                             ShoppingList, Tag)
-from users.constaints import LIMIT_RECIPES
+from api.fields import (BulkPrimaryKeyRelatedField, BulkRelatedListSerializer,
+                        find_duplicates)
+from api.images import variant_urls
+from api.membership import get_membership
+from api.metrics import count_cache
+from foodgram.models import (Ingredient, IngredientRecipe, Recipe,
+                             ShoppingCartIngredient, Tag)
+from users.constaints import BATCH_MAX_SIZE, LIMIT_RECIPES
 from users.models import FollowUser, User
 
 
+def get_recipes_limit(request):
+    """Сколько рецептов автора показывать в подписках."""
+    return int(request.GET.get('recipes_limit', LIMIT_RECIPES))
+
+
 class UserRegisterSerializer(UserCreateSerializer):
     """Cоздание нового пользователя."""
     class Meta:
@@ -71,13 +84,10 @@ class UserSerializer(UserSerializer):
 
     def get_is_subscribed(self, author):
         """отображение подписок."""
-        request = self.context.get('request')
-        if request.user.is_authenticated:
-            return FollowUser.objects.filter(
-                author=author,
-                user=request.user,
-            ).exists()
-        return False
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
+        membership = get_membership(self.context.get('request'))
+        return membership.is_subscribed(author.pk)
 
 
 class FollowUserSerializer(serializers.ModelSerializer):
@@ -106,55 +116,31 @@ class FollowUserSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, recipe):
         """Проверка наличия подписки."""
-        author = recipe.author
-        user = self.context.get('request').user
-        return FollowUser.objects.filter(author=author, user=user).exists()
+        if hasattr(recipe, 'is_subscribed'):
+            return recipe.is_subscribed
+        membership = get_membership(self.context.get('request'))
+        return membership.is_subscribed(recipe.author_id)
 
     def get_recipes(self, recipe):
         """Список рецептов автора."""
-        author = recipe.author
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit', LIMIT_RECIPES)
-        limit = int(limit)
-        return FollowRecipeSerializer(
-            Recipe.objects.filter(author=author)[:limit],
-            many=True
-        ).data
+        previews = self.context.get('recipes')
+        if previews is not None:
+            recipes = previews.get(recipe.author_id, [])
+        else:
+            request = self.context.get('request')
+            recipes = Recipe.objects.filter(
+                author=recipe.author
+            )[:get_recipes_limit(request)]
+        return FollowRecipeSerializer(recipes, many=True).data
 
     def get_recipes_count(self, recipe):
         """Количествво рецептов автора."""
+        if hasattr(recipe, 'recipes_count'):
+            return recipe.recipes_count
         author = recipe.author
         return Recipe.objects.filter(author=author).count()
 
 
-class FollowSerializer(serializers.ModelSerializer):
-    """Сериализатор валидации подписок."""
-
-    class Meta:
-        model = FollowUser
-        fields = (
-            'user',
-            'author'
-        )
-
-    def validate(self, data):
-        """Валидация на подписку."""
-        author = data['author']
-        user = data['user']
-        if author == user:
-            raise serializers.ValidationError(
-                'Нельзя подписываться на самого себя!')
-        if FollowUser.objects.filter(author=author, user=user).exists():
-            raise serializers.ValidationError(
-                'Вы уже подписаны на этого автора!')
-        return data
-
-    def to_representation(self, author):
-        """Данные о подписках."""
-        serializer = FollowUserSerializer(author, context=self.context)
-        return serializer.data
-
-
 class TagSerializer(serializers.ModelSerializer):
     """Сериализатор Тегов."""
     class Meta:
@@ -182,7 +168,7 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
 
 class PostIngredientRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для добавления ингредиентов в рецепт."""
-    id = serializers.PrimaryKeyRelatedField(
+    id = BulkPrimaryKeyRelatedField(
         queryset=Ingredient.objects.all(),
         source='ingredient',
     )
@@ -191,6 +177,7 @@ class PostIngredientRecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = IngredientRecipe
         fields = ('id', 'recipe', 'amount')
+        list_serializer_class = BulkRelatedListSerializer
 
 
 class GetIngredientRecipeSerializer(serializers.ModelSerializer):
@@ -211,6 +198,67 @@ class GetIngredientRecipeSerializer(serializers.ModelSerializer):
         )
 
 
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов из закэшированных фрагментов.
+
+    Часть рецепта, общая для всех пользователей, кэшируется под ключом
+    с updated_at, поэтому любое изменение рецепта даёт новый ключ.
+    Фрагменты страницы читаются одним get_many, недостающие
+    сериализуются из одного запроса, а флаги текущего пользователя
+    накладываются поверх.
+    """
+
+    def fragment_key(self, recipe, site):
+        return f'recipe:{recipe.pk}:{recipe.updated_at.timestamp()}:{site}'
+
+    def load_fragments(self, keys):
+        fragments = {}
+        recipes = Recipe.objects.filter(pk__in=keys).defer(
+            'search_vector'
+        ).with_related()
+        for recipe in recipes:
+            fragment = self.child.to_representation(recipe)
+            fragment.pop('is_favorited')
+            fragment.pop('is_in_shopping_cart')
+            fragment['author'].pop('is_subscribed')
+            fragments[keys[recipe.pk]] = fragment
+        cache.set_many(fragments, settings.RECIPE_FRAGMENT_CACHE_TTL)
+        return fragments
+
+    def to_representation(self, data):
+        request = self.context.get('request')
+        site = request.build_absolute_uri('/')
+        recipes = list(data)
+        keys = {
+            recipe.pk: self.fragment_key(recipe, site) for recipe in recipes
+        }
+        fragments = cache.get_many(keys.values())
+        missing = {
+            pk: key for pk, key in keys.items() if key not in fragments
+        }
+        count_cache('recipes:fragment', True, len(fragments))
+        count_cache('recipes:fragment', False, len(missing))
+        if missing:
+            fragments.update(self.load_fragments(missing))
+        membership = get_membership(request)
+        result = []
+        for recipe in recipes:
+            fragment = fragments.get(keys[recipe.pk])
+            if fragment is None:
+                continue
+            fragment = dict(fragment)
+            fragment['author'] = dict(
+                fragment['author'],
+                is_subscribed=membership.is_subscribed(recipe.author_id),
+            )
+            fragment['is_favorited'] = membership.is_favorited(recipe.pk)
+            fragment['is_in_shopping_cart'] = membership.is_in_shopping_cart(
+                recipe.pk
+            )
+            result.append(fragment)
+        return result
+
+
 class RecipeGetSerializer(serializers.ModelSerializer):
     """Сериализатор отображения рецептов при GET запросе."""
     author = UserSerializer()
@@ -220,6 +268,7 @@ class RecipeGetSerializer(serializers.ModelSerializer):
     )
     tags = TagSerializer(many=True)
     image = Base64ImageField()
+    image_variants = serializers.SerializerMethodField(read_only=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
@@ -232,30 +281,26 @@ class RecipeGetSerializer(serializers.ModelSerializer):
                   'ingredients',
                   'tags',
                   'image',
+                  'image_variants',
                   'cooking_time',
                   'is_favorited',
                   'is_in_shopping_cart'
                   )
+        list_serializer_class = RecipeListSerializer
+
+    def get_image_variants(self, recipe):
+        """Ссылки на уменьшенные копии в JPEG и WebP."""
+        return variant_urls(recipe, self.context.get('request'))
 
-    def get_is_in_shopping_cart(self, shopping_cart):
+    def get_is_in_shopping_cart(self, recipe):
         """Отображение рецепта в корзине."""
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            return ShoppingList.objects.filter(
-                author=user,
-                recipe=shopping_cart
-            ).exists()
-        return False
-
-    def get_is_favorited(self, favorite):
+        membership = get_membership(self.context.get('request'))
+        return membership.is_in_shopping_cart(recipe.pk)
+
+    def get_is_favorited(self, recipe):
         """Отображение рецепта в избранном."""
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            return Favorite.objects.filter(
-                author=user,
-                recipe=favorite
-            ).exists()
-        return False
+        membership = get_membership(self.context.get('request'))
+        return membership.is_favorited(recipe.pk)
 
 
 class RecipePostSerializer(serializers.ModelSerializer):
@@ -264,8 +309,8 @@ class RecipePostSerializer(serializers.ModelSerializer):
         many=True,
         source='recipe_ingredient'
     )
-    tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(),
-                                              many=True)
+    tags = BulkPrimaryKeyRelatedField(queryset=Tag.objects.all(),
+                                      many=True)
     author = serializers.HiddenField(
         default=serializers.CurrentUserDefault()
     )
@@ -292,24 +337,24 @@ class RecipePostSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Необходимо добавить ингредиенты!'
             )
-        ingredients_list = []
-        for ingredient in ingredients:
-            if ingredient in ingredients_list:
-                raise serializers.ValidationError(
-                    'Ингредиенты должны быть разными!'
-                )
-            ingredients_list.append(ingredient)
+        duplicates = find_duplicates(
+            item['ingredient'].pk for item in ingredients
+        )
+        if duplicates:
+            raise serializers.ValidationError(
+                'Ингредиенты должны быть разными! Повторяются: '
+                + ', '.join(map(str, duplicates))
+            )
         if not tags:
             raise serializers.ValidationError(
                 'Необходимо добавить тег!'
             )
-        tag_list = []
-        for tag in tags:
-            if tag in tag_list:
-                raise serializers.ValidationError(
-                    'Теги должны быть разными!'
-                )
-            tag_list.append(tag)
+        duplicates = find_duplicates(tag.pk for tag in tags)
+        if duplicates:
+            raise serializers.ValidationError(
+                'Теги должны быть разными! Повторяются: '
+                + ', '.join(map(str, duplicates))
+            )
         if not image:
             raise serializers.ValidationError(
                 'Необходимо добавить изображение!'
@@ -327,6 +372,7 @@ class RecipePostSerializer(serializers.ModelSerializer):
                 recipe=recipe))
         IngredientRecipe.objects.bulk_create(all_ingredients)
 
+    @transaction.atomic
     def create(self, validated_data):
         """Создание рецепта."""
         ingredients = validated_data.pop('recipe_ingredient')
@@ -336,15 +382,65 @@ class RecipePostSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.create_ingredients(recipe, ingredients)
+        Recipe.objects.filter(pk=recipe.pk).update_search_vector()
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """Изменение состава рецепта по разнице со старым.
+
+        Меняются только отличающиеся строки, а суммы в корзинах
+        пересчитываются, только если состав действительно изменился.
+        Рецепт блокируется FOR UPDATE: добавление и удаление его из
+        корзин ждёт, пока суммы не будут пересчитаны по новому составу.
+        """
+        list(Recipe.objects.select_for_update().filter(
+            pk=recipe.pk
+        ).values_list('pk'))
+        existing = {
+            row.ingredient_id: row
+            for row in IngredientRecipe.objects.select_for_update().filter(
+                recipe=recipe
+            )
+        }
+        amounts = {
+            item['ingredient'].pk: item['amount'] for item in ingredients
+        }
+        changed = []
+        for ingredient_id, row in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        added = [
+            IngredientRecipe(
+                recipe=recipe,
+                ingredient=item['ingredient'],
+                amount=item['amount'],
+            )
+            for item in ingredients
+            if item['ingredient'].pk not in existing
+        ]
+        removed = [
+            ingredient_id for ingredient_id in existing
+            if ingredient_id not in amounts
+        ]
+        if not (changed or added or removed):
+            return
+        ShoppingCartIngredient.objects.remove_recipe(recipe.pk)
+        IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        IngredientRecipe.objects.bulk_create(added)
+        IngredientRecipe.objects.filter(
+            recipe=recipe, ingredient_id__in=removed
+        ).delete()
+        ShoppingCartIngredient.objects.add_recipe(recipe.pk)
+
+    @transaction.atomic
     def update(self, recipes, validated_data):
         """Обновление рецепта."""
         tags = validated_data.pop('tags')
         recipes.tags.set(tags)
         ingredients = validated_data.pop('recipe_ingredient')
-        IngredientRecipe.objects.filter(recipe=recipes).delete()
-        self.create_ingredients(recipes, ingredients)
+        self.update_ingredients(recipes, ingredients)
         super().update(recipes, validated_data)
         return recipes
 
@@ -354,76 +450,14 @@ class RecipePostSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         """отображение подписок."""
-        request = self.context.get('request')
-        if request.user.is_authenticated:
-            author = obj.author
-            return FollowUser.objects.filter(
-                author=author,
-                user=request.user,
-            ).exists()
-        return False
+        membership = get_membership(self.context.get('request'))
+        return membership.is_subscribed(obj.author_id)
 
 
-class RecipeFollowSerializer(serializers.ModelSerializer):
-    """Сериализатор для корзины и избранного"""
-    class Meta:
-        model = Recipe
-        fields = (
-            'id',
-            'name',
-            'image',
-            'cooking_time'
-        )
-
-
-class ShoppingListSerializer(serializers.ModelSerializer):
-    """Сериализатор Списка покупок."""
-    class Meta:
-        model = ShoppingList
-        fields = (
-            'author',
-            'recipe'
-        )
-
-    def validate(self, data):
-        """Валидация покупок."""
-        user = data['author']
-        recipe = data['recipe']
-        if ShoppingList.objects.filter(author=user, recipe=recipe).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже был добавлен!'
-            )
-        return data
-
-    def to_representation(self, shopping_list):
-        """Данные о списке покупок."""
-        recipe = shopping_list.recipe
-        serializers = RecipeFollowSerializer(recipe, context=self.context)
-        return serializers.data
-
-
-class RecipeFavoriteSerializer(serializers.ModelSerializer):
-    """Сериализатор Избранного."""
-
-    class Meta:
-        model = Favorite
-        fields = (
-            'author',
-            'recipe'
-        )
-
-    def validate(self, data):
-        """Валидация Избранного."""
-        user = data['author']
-        recipe = data['recipe']
-        if Favorite.objects.filter(author=user, recipe=recipe).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже был добавлен!'
-            )
-        return data
-
-    def to_representation(self, favorite):
-        """Данные о Избранном."""
-        recipe = favorite.recipe
-        serializers = RecipeFollowSerializer(recipe, context=self.context)
-        return serializers.data
+class BatchSerializer(serializers.Serializer):
+    """Список id для пакетного добавления."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_MAX_SIZE,
+    )
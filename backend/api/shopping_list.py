@@ -0,0 +1,103 @@
+import csv
+import json
+from functools import lru_cache
+from itertools import chain
+
+from django.conf import settings
+
+from api.pdf import StreamingPDF, TrueTypeFont
+from foodgram.models import ShoppingCartIngredient
+
+CHUNK_SIZE = 500
+LARGER_UNITS = {'г': ('кг', 1000), 'мл': ('л', 1000)}
+
+
+def normalize_amount(amount):
+    """Количество без лишних знаков после запятой."""
+    amount = round(amount, 3)
+    if amount == int(amount):
+        return int(amount)
+    return amount
+
+
+def format_amount(amount):
+    return str(normalize_amount(amount))
+
+
+def display_amount(amount, unit):
+    """Перевод в более крупную единицу, если её больше одной."""
+    larger_unit, factor = LARGER_UNITS.get(unit, (None, None))
+    if larger_unit and amount >= factor:
+        amount, unit = amount / factor, larger_unit
+    return normalize_amount(amount), unit
+
+
+def shopping_list_items(user):
+    """Ингредиенты корзины по алфавиту.
+
+    Суммы заранее посчитаны в ShoppingCartIngredient, по строке на
+    ингредиент, а строки читаются курсором на стороне сервера.
+    Большие количества в г и мл выводятся в кг и л.
+    """
+    rows = ShoppingCartIngredient.objects.filter(
+        author=user
+    ).values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
+    ).order_by('ingredient__name')
+    for name, unit, amount in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield name, *display_amount(amount, unit)
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает записанное."""
+
+    def write(self, value):
+        return value
+
+
+def render_txt(items):
+    yield 'Что купить: \n'
+    for name, amount, unit in items:
+        yield f' - {name}: {format_amount(amount)} {unit}.\n'
+
+
+def render_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица'))
+    for name, amount, unit in items:
+        yield writer.writerow((name, format_amount(amount), unit))
+
+
+def render_json(items):
+    separator = '['
+    for name, amount, unit in items:
+        yield separator + json.dumps({
+            'name': name,
+            'amount': amount,
+            'measurement_unit': unit,
+        }, ensure_ascii=False)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+@lru_cache(maxsize=None)
+def get_pdf_font():
+    return TrueTypeFont(settings.SHOPPING_LIST_PDF_FONT)
+
+
+def render_pdf(items):
+    lines = (
+        f' - {name}: {format_amount(amount)} {unit}.'
+        for name, amount, unit in items
+    )
+    return StreamingPDF(get_pdf_font()).render(
+        chain(['Что купить:'], lines)
+    )
+
+
+FORMATS = {
+    'txt': ('text/plain; charset=utf-8', render_txt),
+    'csv': ('text/csv; charset=utf-8', render_csv),
+    'json': ('application/json', render_json),
+    'pdf': ('application/pdf', render_pdf),
+}
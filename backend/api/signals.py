@@ -0,0 +1,159 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from api.cache import bump_version
+from api.images import image_names, release_images, schedule_recipe_image
+from api.ingredient_index import ingredient_index
+from api.membership import invalidate
+from foodgram.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                             ShoppingCartIngredient, ShoppingList, Tag)
+from users.models import FollowUser, User
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def rebuild_ingredient_index(**kwargs):
+    """Пересборка индекса поиска и кэша после изменения ингредиентов."""
+    transaction.on_commit(ingredient_index.rebuild)
+    transaction.on_commit(lambda: bump_version('ingredients'))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags(**kwargs):
+    """Новая версия кэша тегов."""
+    transaction.on_commit(lambda: bump_version('tags'))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_pages(**kwargs):
+    """Новая версия кэша страниц рецептов для анонимов."""
+    transaction.on_commit(lambda: bump_version('recipes'))
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(instance, **kwargs):
+    """Поисковый вектор рецепта после его сохранения."""
+    Recipe.objects.filter(pk=instance.pk).update_search_vector()
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_image(instance, **kwargs):
+    """Прежнее изображение рецепта, чтобы отпустить его после замены."""
+    instance.stored_image = instance.pk and Recipe.objects.filter(
+        pk=instance.pk
+    ).values_list('image', flat=True).first()
+    instance.image_uploaded = bool(
+        instance.image and not instance.image._committed
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_image_variants(instance, **kwargs):
+    """Уменьшенные копии нового изображения рецепта.
+
+    Прежние копии отпускает обработчик, когда запишет новые. Если
+    загружена та же картинка, хранилище взяло на неё вторую ссылку,
+    и прежняя отпускается так же, как при замене.
+    """
+    source = instance.image_variants.get('source')
+    if instance.image and source != instance.image.name:
+        schedule_recipe_image(instance.pk)
+    stored = getattr(instance, 'stored_image', None)
+    if stored and (
+        stored != instance.image.name
+        or getattr(instance, 'image_uploaded', False)
+    ):
+        transaction.on_commit(lambda: release_images([stored]))
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(instance, **kwargs):
+    """Файлы удалённого рецепта."""
+    names = list(image_names(instance.image.name, instance.image_variants))
+    transaction.on_commit(lambda: release_images(names))
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes(instance, created, **kwargs):
+    """Поисковые векторы и время изменения рецептов с ингредиентом."""
+    if not created:
+        recipes = Recipe.objects.filter(
+            ingredient_recipe__ingredient=instance
+        )
+        recipes.update_search_vector()
+        recipes.touch()
+
+
+@receiver(pre_delete, sender=Ingredient)
+def touch_ingredient_recipes(instance, **kwargs):
+    Recipe.objects.filter(ingredient_recipe__ingredient=instance).touch()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_tag_recipes(instance, **kwargs):
+    """Время изменения рецептов с изменённым тегом."""
+    Recipe.objects.filter(tags=instance).touch()
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(instance, created, update_fields, **kwargs):
+    """Время изменения рецептов автора, чей профиль поменялся."""
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    if Recipe.objects.filter(author=instance).touch():
+        transaction.on_commit(lambda: bump_version('recipes'))
+
+
+@receiver(post_save, sender=ShoppingList)
+def add_to_cart_totals(instance, created, **kwargs):
+    """Ингредиенты добавленного в корзину рецепта."""
+    if created:
+        ShoppingCartIngredient.objects.add_recipe(
+            instance.recipe_id, instance.author_id
+        )
+
+
+@receiver(pre_delete, sender=ShoppingList)
+def remove_from_cart_totals(instance, **kwargs):
+    """Ингредиенты убранного из корзины рецепта.
+
+    pre_delete, а не post_delete: при каскадном удалении рецепта
+    его ингредиенты ещё не удалены.
+    """
+    Recipe.objects.lock_shared([instance.recipe_id])
+    ShoppingCartIngredient.objects.remove_recipe(
+        instance.recipe_id, instance.author_id
+    )
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def invalidate_favorites(instance, **kwargs):
+    """Сброс кэша избранного пользователя."""
+    transaction.on_commit(lambda: invalidate('favorites', instance.author_id))
+
+
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+def invalidate_cart(instance, **kwargs):
+    """Сброс кэша корзины пользователя."""
+    transaction.on_commit(lambda: invalidate('cart', instance.author_id))
+
+
+@receiver(post_save, sender=FollowUser)
+@receiver(post_delete, sender=FollowUser)
+def invalidate_following(instance, **kwargs):
+    """Сброс кэша подписок пользователя."""
+    transaction.on_commit(lambda: invalidate('following', instance.user_id))
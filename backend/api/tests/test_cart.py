@@ -0,0 +1,178 @@
+import base64
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from foodgram.models import (Ingredient, IngredientRecipe, Recipe,
+                             ShoppingCartIngredient, ShoppingCartVersion,
+                             ShoppingList, Tag)
+from users.models import User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def image_data():
+    buffer = BytesIO()
+    Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+@override_settings(
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }},
+    MEDIA_ROOT=MEDIA_ROOT,
+)
+class CartTotalsTest(TestCase):
+    """Суммы ингредиентов корзины и её версия при каждом изменении."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author = (
+            User.objects.create_user(
+                username=username, email=f'{username}@example.com',
+                password='pass', first_name='Имя', last_name='Фамилия',
+            )
+            for username in ('buyer', 'cook')
+        )
+        cls.tag = Tag.objects.create(
+            name='Обед', color='#FFFFFF', slug='lunch'
+        )
+        cls.flour, cls.milk, cls.salt = (
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name, unit in (('Мука', 'г'), ('Молоко', 'мл'), ('Соль', 'г'))
+        )
+        cls.pancakes = cls.create_recipe(
+            'Блины', {cls.flour: 100, cls.milk: 50}
+        )
+        cls.bread = cls.create_recipe('Хлеб', {cls.flour: 30, cls.salt: 5})
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def create_recipe(cls, name, amounts):
+        recipe = Recipe.objects.create(
+            author=cls.author, name=name, text='Описание', cooking_time=10,
+            image='foodgram/recipe.png',
+        )
+        recipe.tags.set([cls.tag])
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+            for ingredient, amount in amounts.items()
+        )
+        return recipe
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.author)
+
+    def totals(self):
+        return dict(ShoppingCartIngredient.objects.filter(
+            author=self.user
+        ).values_list('ingredient__name', 'amount'))
+
+    def version(self):
+        return ShoppingCartVersion.objects.get_version(self.user)
+
+    def add(self, recipe):
+        response = self.client.post(
+            f'/api/recipes/{recipe.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_add(self):
+        self.add(self.pancakes)
+        self.assertEqual(self.totals(), {'Мука': 100, 'Молоко': 50})
+        self.assertEqual(self.version(), 1)
+        self.add(self.bread)
+        self.assertEqual(
+            self.totals(), {'Мука': 130, 'Молоко': 50, 'Соль': 5}
+        )
+        self.assertEqual(self.version(), 2)
+
+    def test_add_twice(self):
+        self.add(self.pancakes)
+        response = self.client.post(
+            f'/api/recipes/{self.pancakes.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.totals(), {'Мука': 100, 'Молоко': 50})
+        self.assertEqual(self.version(), 1)
+
+    def test_remove(self):
+        self.add(self.pancakes)
+        self.add(self.bread)
+        response = self.client.delete(
+            f'/api/recipes/{self.pancakes.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.totals(), {'Мука': 30, 'Соль': 5})
+        self.assertEqual(self.version(), 3)
+        self.client.delete(f'/api/recipes/{self.bread.pk}/shopping_cart/')
+        self.assertEqual(self.totals(), {})
+        self.assertEqual(self.version(), 4)
+
+    def test_batch_add(self):
+        response = self.client.post(
+            '/api/recipes/shopping_cart/batch/',
+            {'ids': [self.pancakes.pk, self.bread.pk]}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.totals(), {'Мука': 130, 'Молоко': 50, 'Соль': 5}
+        )
+        self.assertEqual(self.version(), 1)
+
+    def edit_pancakes(self, amounts):
+        response = self.author_client.patch(
+            f'/api/recipes/{self.pancakes.pk}/',
+            {
+                'name': 'Блины', 'text': 'Описание', 'cooking_time': 10,
+                'image': image_data(), 'tags': [self.tag.pk],
+                'ingredients': [
+                    {'id': ingredient.pk, 'amount': amount}
+                    for ingredient, amount in amounts.items()
+                ],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_ingredient_edit(self):
+        self.add(self.pancakes)
+        self.add(self.bread)
+        self.edit_pancakes({self.flour: 200, self.salt: 10})
+        self.assertEqual(self.totals(), {'Мука': 230, 'Соль': 15})
+        self.assertEqual(self.version(), 4)
+
+    def test_edit_without_ingredient_changes(self):
+        self.add(self.pancakes)
+        self.edit_pancakes({self.flour: 100, self.milk: 50})
+        self.assertEqual(self.totals(), {'Мука': 100, 'Молоко': 50})
+        self.assertEqual(self.version(), 1)
+
+    def test_recipe_delete(self):
+        self.add(self.pancakes)
+        self.add(self.bread)
+        response = self.author_client.delete(
+            f'/api/recipes/{self.pancakes.pk}/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(ShoppingList.objects.filter(
+            recipe_id=self.pancakes.pk
+        ).exists())
+        self.assertEqual(self.totals(), {'Мука': 30, 'Соль': 5})
+        self.assertEqual(self.version(), 3)
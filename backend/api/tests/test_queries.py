@@ -0,0 +1,82 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from foodgram.models import Favorite, Ingredient, IngredientRecipe, Recipe, Tag
+from users.models import FollowUser, User
+
+RECIPES_COUNT = 12
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class RecipeQueriesTest(TestCase):
+    """Число запросов к БД на чтение рецептов не зависит от их числа."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass',
+            first_name='Читатель', last_name='Рецептов',
+        )
+        authors = [
+            User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com',
+                password='pass', first_name='Автор', last_name='Рецептов',
+            )
+            for number in range(3)
+        ]
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color='#FFFFFF', slug=f'tag{number}'
+            )
+            for number in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(3)
+        ]
+        for number in range(RECIPES_COUNT):
+            recipe = Recipe.objects.create(
+                author=authors[number % len(authors)],
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+                image='foodgram/recipe.png',
+            )
+            recipe.tags.set(tags)
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=100
+                )
+                for ingredient in ingredients
+            )
+            if number % 2:
+                Favorite.objects.create(author=cls.user, recipe=recipe)
+        FollowUser.objects.create(user=cls.user, author=recipe.author)
+        cls.recipe = recipe
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_queries_do_not_grow_with_limit(self):
+        for limit in (2, RECIPES_COUNT // 2):
+            cache.clear()
+            with self.subTest(limit=limit), self.assertNumQueries(9):
+                response = self.client.get(
+                    '/api/recipes/', {'limit': limit}
+                )
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_detail_queries(self):
+        with self.assertNumQueries(7):
+            response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertTrue(response.data['author']['is_subscribed'])
@@ -0,0 +1,89 @@
+import re
+import struct
+from pathlib import Path
+from unittest import skipUnless
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from api.pdf import StreamingPDF, components
+from api.shopping_list import get_pdf_font, render_pdf
+
+ITEMS = [
+    ('Картофель', 1.5, 'кг'),
+    ('Молоко', 200, 'мл'),
+    ('Сыр «Пармезан»', 3, 'шт'),
+]
+
+
+def without_components(glyph):
+    """Данные глифа без номеров компонентов: их подмножество меняет."""
+    glyph = bytearray(glyph.rstrip(b'\0'))
+    for position in components(bytes(glyph)):
+        glyph[position:position + 2] = b'\0\0'
+    return glyph
+
+
+def glyph_data(font_file, glyph):
+    """Данные глифа из файла шрифта с длинной таблицей loca."""
+    tables = {}
+    for position in range(12, 12 + struct.unpack_from(
+        '>H', font_file, 4
+    )[0] * 16, 16):
+        tag, _, offset, length = struct.unpack_from(
+            '>4sIII', font_file, position
+        )
+        tables[tag] = offset
+    start, end = struct.unpack_from(
+        '>2I', font_file, tables[b'loca'] + glyph * 4
+    )
+    return font_file[tables[b'glyf'] + start:tables[b'glyf'] + end]
+
+
+@skipUnless(
+    Path(settings.SHOPPING_LIST_PDF_FONT).exists(), 'Нет шрифта для PDF.'
+)
+class ShoppingListPDFTest(SimpleTestCase):
+    """PDF списка покупок: структура файла и встроенный шрифт."""
+
+    def setUp(self):
+        self.pdf = b''.join(render_pdf(ITEMS))
+
+    def test_xref_points_to_objects(self):
+        self.assertTrue(self.pdf.startswith(b'%PDF-1.4\n'))
+        self.assertTrue(self.pdf.endswith(b'%%EOF\n'))
+        xref = int(re.search(rb'startxref\n(\d+)\n', self.pdf).group(1))
+        self.assertTrue(self.pdf[xref:].startswith(b'xref\n'))
+        offsets = re.findall(rb'(\d{10}) 00000 n ', self.pdf[xref:])
+        for number, offset in enumerate(offsets, start=1):
+            self.assertTrue(
+                self.pdf[int(offset):].startswith(b'%d 0 obj\n' % number)
+            )
+
+    def test_font_is_subset(self):
+        font_file = self.embedded_font()
+        self.assertLess(len(self.pdf), 32 * 1024)
+        self.assertLess(len(font_file), len(get_pdf_font().data) // 10)
+
+    def test_subset_keeps_glyphs(self):
+        font = get_pdf_font()
+        codes = {ord(char) for char in 'Что купить: Пармезан 1.5'}
+        font_file, glyphs = font.subset(codes)
+        self.assertEqual(glyphs.keys(), codes)
+        source = font.table(b'glyf')
+        loca = font.table(b'loca')
+        for code, glyph in glyphs.items():
+            start, end = struct.unpack_from(
+                '>2I', loca, font.glyphs[code] * 4
+            )
+            self.assertEqual(
+                without_components(glyph_data(font_file, glyph)),
+                without_components(source[start:end]),
+            )
+
+    def embedded_font(self):
+        match = re.search(
+            rb'%d 0 obj\n<< /Length (\d+) /Length1 \d+ >>\nstream\n'
+            % StreamingPDF.FONT_FILE, self.pdf
+        )
+        return self.pdf[match.end():match.end() + int(match.group(1))]
@@ -1,6 +1,10 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
@@ -9,15 +13,21 @@ from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
+from api.batch import add_batch
+from api.cache import (AnonymousListCacheMixin, VersionedCacheListMixin,
+                       etag_matches)
 from api.filters import IngredientNameFilter, RecipeFilter
+from api.ingredient_index import ingredient_index
+from api.membership import get_membership, invalidate
+from api.negotiation import IgnoreFormatContentNegotiation
 from api.pagination import Pagination
 from api.permissions import IsAuthorAdminOrReadOnly
-from api.serializers import (FollowSerializer, FollowUserSerializer,
-                             IngredientSerializer, RecipeFavoriteSerializer,
+from api.serializers import (FollowUserSerializer, IngredientSerializer,
                              RecipeGetSerializer, RecipePostSerializer,
-                             ShoppingListSerializer, TagSerializer,
-                             UserSerializer)
-from foodgram.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                             TagSerializer, UserSerializer, get_recipes_limit)
+from api.shopping_list import FORMATS, shopping_list_items
+from foodgram.models import (Favorite, Ingredient, Recipe,
+                             ShoppingCartIngredient, ShoppingCartVersion,
                              ShoppingList, Tag)
 from users.models import FollowUser, User
 
@@ -25,6 +35,15 @@ from users.models import FollowUser, User
 class UserViewSet(UserViewSet):
     """Создание пользователей."""
     pagination_class = Pagination
+    cursor_ordering = None
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        """Подписка текущего пользователя считается в том же запросе."""
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.with_is_subscribed(self.request.user)
+        return queryset
 
     @action(
         detail=False,
@@ -34,6 +53,8 @@ class UserViewSet(UserViewSet):
     )
     def me(self, request):
         """Текущий пользователь."""
+        # Подписку на себя запрещает ограничение в БД.
+        request.user.is_subscribed = False
         serializer = UserSerializer(request.user, context={'request': request})
         if request.method == 'GET':
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -51,61 +72,99 @@ class UserViewSet(UserViewSet):
         detail=True,
         permission_classes=[IsAuthenticated, ],)
     def subscribe(self, request, id):
-        """Подписка или отписка от автора."""
-        author = get_object_or_404(User, id=id)
+        """Подписка или отписка от автора.
+
+        Запись и удаление — по одному запросу к таблице подписок,
+        ответ собирается из выборки с числом рецептов и окна превью.
+        """
         user = request.user
-        data = {'author': author.id,
-                'user': user.id}
+        author_id = int(id)
         if request.method == 'POST':
-            serializer = FollowSerializer(data=data,
-                                          context={'request': request,
-                                                   'pk': id})
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
+            if author_id == user.pk:
+                return Response(
+                    {'errors': 'Нельзя подписываться на самого себя!'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if not FollowUser.objects.add(user.pk, author_id):
+                get_object_or_404(User, id=author_id)
+                return Response(
+                    {'errors': 'Вы уже подписаны на этого автора!'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            transaction.on_commit(lambda: invalidate('following', user.pk))
+            follow = FollowUser.objects.filter(
+                user=user, author_id=author_id
+            ).with_author_summary().get()
+            recipes = Recipe.objects.author_previews(
+                [author_id], get_recipes_limit(request)
+            )
+            serializer = FollowUserSerializer(
+                follow, context={'request': request, 'recipes': recipes}
+            )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        subscription = FollowUser.objects.filter(
-            author=author.id,
-            user=user.id)
-        if not subscription.exists():
+        if not FollowUser.objects.remove(user.pk, author_id):
+            get_object_or_404(User, id=author_id)
             return Response({'errors': "Подписка не найдена!"},
                             status=status.HTTP_400_BAD_REQUEST)
-        if subscription.exists():
-            subscription.delete()
-            return Response(
-                subscription,
-                status=status.HTTP_204_NO_CONTENT
+        transaction.on_commit(lambda: invalidate('following', user.pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(
+        methods=['POST'],
+        detail=False,
+        url_path='subscribe/batch',
+        permission_classes=[IsAuthenticated, ],)
+    def subscribe_batch(self, request):
+        """Подписка сразу на несколько авторов."""
+        user = request.user
+        with transaction.atomic():
+            results, added = add_batch(
+                request, FollowUser, User.objects.all(), 'user', 'author',
+                forbidden={user.pk},
             )
-        return Response({'errors': "Вы не подписаны на данного автора!"},
-                        status=status.HTTP_400_BAD_REQUEST)
+            if added:
+                transaction.on_commit(
+                    lambda: invalidate('following', user.pk)
+                )
+        return Response({'results': results}, status=status.HTTP_200_OK)
 
     @action(
         detail=False,
         methods=['GET'],
         permission_classes=[IsAuthenticated],
+        cursor_ordering=('author_id',),
     )
     def subscriptions(self, request):
         """Подписки пользователя."""
         paginate_queryset = self.paginate_queryset(
-            FollowUser.objects.filter(user=request.user)
+            FollowUser.objects.filter(
+                user=request.user
+            ).with_author_summary().order_by('author')
+        )
+        recipes = Recipe.objects.author_previews(
+            [follow.author_id for follow in paginate_queryset],
+            get_recipes_limit(request),
         )
         serializer = FollowUserSerializer(
             paginate_queryset,
             many=True,
-            context={'request': request}
+            context={'request': request, 'recipes': recipes}
         )
         return self.get_paginated_response(serializer.data)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(VersionedCacheListMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет для создания тегов."""
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     http_method_names = ['get', ]
     pagination_class = None
+    cache_name = 'tags'
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(VersionedCacheListMixin,
+                        viewsets.ReadOnlyModelViewSet):
     """Вьюсет для создания ингредиентов."""
 
     queryset = Ingredient.objects.all()
@@ -113,9 +172,17 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientNameFilter
     pagination_class = None
+    cache_name = 'ingredients'
+
+    def list(self, request, *args, **kwargs):
+        """Поиск по названию обслуживается индексом, а не БД."""
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(name))
+        return self.cached_list(request)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AnonymousListCacheMixin, viewsets.ModelViewSet):
     """Вьюсет для создания рецептов."""
 
     queryset = Recipe.objects.all()
@@ -125,6 +192,65 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     http_method_names = ['get', 'post', 'patch', 'delete']
+    cursor_ordering = ('-created_at', 'id')
+    cache_name = 'recipes'
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        """Связанные объекты для чтения загружаются заранее.
+
+        Для списка читаются только поля ключа фрагментов и сортировки:
+        остальное RecipeListSerializer берёт из кэша.
+        """
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            return queryset.only(
+                'id', 'author_id', 'created_at', 'updated_at'
+            )
+        if self.request.method == 'GET':
+            queryset = queryset.defer('search_vector').with_related()
+        return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        """Рецепт с поддержкой If-None-Match и If-Modified-Since.
+
+        Флаги текущего пользователя входят в ETag, поэтому 304 не
+        скроет изменившееся избранное или корзину. Last-Modified
+        отдаётся только анонимам: время изменения флагов не хранится.
+        """
+        user = request.user
+        updated_at, author_id = get_object_or_404(
+            Recipe.objects.filter(pk=kwargs['pk']).values_list(
+                'updated_at', 'author_id'
+            )
+        )
+        membership = get_membership(request)
+        recipe_id = int(kwargs['pk'])
+        flags = (
+            membership.is_favorited(recipe_id),
+            membership.is_in_shopping_cart(recipe_id),
+            membership.is_subscribed(author_id),
+        )
+        etag = quote_etag('{}-{}-{}'.format(
+            kwargs['pk'],
+            updated_at.timestamp(),
+            ''.join(str(int(flag)) for flag in flags),
+        ))
+        last_modified = None
+        if not user.is_authenticated:
+            last_modified = int(updated_at.timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        if user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
 
     def get_serializer_class(self):
         """Определяет какой сериализатор будет использоваться"""
@@ -132,23 +258,44 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return RecipeGetSerializer
         return RecipePostSerializer
 
-    def post_delete(self, serializer_class, models, request, pk):
+    def post_delete(self, models, request, pk):
+        """Добавление или удаление рецепта одним запросом к таблице.
+
+        Повторное нажатие не приводит к ошибке БД: вставка
+        пропускает существующую строку, а удаление сообщает, удалило
+        ли оно что-то. Сигналы при этом не посылаются, поэтому суммы
+        корзины и кэш членства обновляются здесь.
+        """
         user = request.user
-        data = {'author': user.id,
-                'recipe': pk}
+        pk = int(pk)
+        kind = 'cart' if models is ShoppingList else 'favorites'
         if request.method == 'POST':
-            serializer = serializer_class(
-                data=data,
-                context={'request': request, 'pk': pk}
+            with transaction.atomic():
+                added = models.objects.add(user.pk, pk)
+                if added and models is ShoppingList:
+                    ShoppingCartIngredient.objects.add_recipe(pk, user.pk)
+            recipe = Recipe.objects.filter(pk=pk).values(
+                'id', 'name', 'image', 'cooking_time'
+            ).first()
+            if recipe is None:
+                return Response({'errors': 'Рецепт не существует!'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            if not added:
+                return Response({'errors': 'Рецепт уже был добавлен!'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            transaction.on_commit(lambda: invalidate(kind, user.pk))
+            recipe['image'] = request.build_absolute_uri(
+                default_storage.url(recipe['image'])
             )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        delete_follow = models.objects.filter(
-            author=user,
-            recipe__id=pk)
-        if delete_follow.exists():
-            delete_follow.delete()
+            return Response(recipe, status=status.HTTP_201_CREATED)
+        with transaction.atomic():
+            if models is ShoppingList:
+                Recipe.objects.lock_shared([pk])
+            deleted = models.objects.remove(user.pk, pk)
+            if deleted and models is ShoppingList:
+                ShoppingCartIngredient.objects.subtract_recipe(pk, user.pk)
+        if deleted:
+            transaction.on_commit(lambda: invalidate(kind, user.pk))
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'errors': "Рецепт не существует!"},
                         status=status.HTTP_404_NOT_FOUND)
@@ -156,14 +303,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(
         methods=['POST', 'DELETE'],
         detail=True,
-        permission_classes=[IsAuthenticated, ],
-        serializer_class=RecipeFavoriteSerializer,
-        queryset=Favorite.objects.all(),
-    )
+        permission_classes=[IsAuthenticated, ],)
     def favorite(self, request, pk):
         """Добавление и удаление из Избранного."""
-        models = Favorite
-        return self.post_delete(RecipeFavoriteSerializer, models, request, pk)
+        return self.post_delete(Favorite, request, pk)
 
     @action(
         methods=['POST', 'DELETE'],
@@ -171,27 +314,73 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated, ],)
     def shopping_cart(self, request, pk):
         """Добавление и удаление из Списка покупок."""
-        models = ShoppingList
-        return self.post_delete(ShoppingListSerializer, models, request, pk)
+        return self.post_delete(ShoppingList, request, pk)
 
     @action(
-        methods=['GET'],
+        methods=['POST'],
+        detail=False,
+        url_path='favorite/batch',
+        permission_classes=[IsAuthenticated, ],)
+    def favorite_batch(self, request):
+        """Добавление в Избранное сразу нескольких рецептов."""
+        user = request.user
+        with transaction.atomic():
+            results, added = add_batch(
+                request, Favorite, Recipe.objects.all(), 'author', 'recipe'
+            )
+            if added:
+                transaction.on_commit(
+                    lambda: invalidate('favorites', user.pk)
+                )
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(
+        methods=['POST'],
         detail=False,
+        url_path='shopping_cart/batch',
         permission_classes=[IsAuthenticated, ],)
+    def shopping_cart_batch(self, request):
+        """Добавление в Список покупок сразу нескольких рецептов.
+
+        bulk_create не посылает сигналов, поэтому суммы корзины и кэш
+        обновляются здесь.
+        """
+        user = request.user
+        with transaction.atomic():
+            results, added = add_batch(
+                request, ShoppingList, Recipe.objects.all(), 'author',
+                'recipe',
+            )
+            if added:
+                ShoppingCartIngredient.objects.add_recipes(added, user.pk)
+                transaction.on_commit(lambda: invalidate('cart', user.pk))
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=[IsAuthenticated, ],
+        content_negotiation_class=IgnoreFormatContentNegotiation,)
     def download_shopping_cart(self, request):
         """Качаем список покупок."""
-        ingredients_list = IngredientRecipe.objects.filter(
-            recipe__shopping_list__author=request.user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(sum_amount=Sum('amount'))
-        text = 'Что купить: \n'
-        for ingredient in ingredients_list:
-            text += (f' - {ingredient["ingredient__name"]}: '
-                     f'{ingredient["sum_amount"]} '
-                     f'{ingredient["ingredient__measurement_unit"]}.\n')
-        response = HttpResponse(text, content_type='text/plain')
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in FORMATS:
+            return Response(
+                {'errors': f'Формат {file_format} не поддерживается!'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        version = ShoppingCartVersion.objects.get_version(request.user)
+        etag = quote_etag(f'cart-{version}-{file_format}')
+        if etag_matches(request, etag):
+            return HttpResponseNotModified(headers={'ETag': etag})
+        content_type, render = FORMATS[file_format]
+        response = StreamingHttpResponse(
+            render(shopping_list_items(request.user)),
+            content_type=content_type
+        )
         response['Content-Disposition'] = (
-            'attachment;filename="shopping_list.txt"'
+            f'attachment;filename="shopping_list.{file_format}"'
         )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
         return response
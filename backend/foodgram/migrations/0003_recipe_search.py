@@ -0,0 +1,76 @@
+# Generated by Django 4.2 on 2026-10-18 04:25
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_search_vector(apps, schema_editor):
+    Recipe = apps.get_model('foodgram', 'Recipe')
+    IngredientRecipe = apps.get_model('foodgram', 'IngredientRecipe')
+    ingredient_names = IngredientRecipe.objects.filter(
+        recipe=OuterRef('pk')
+    ).values('recipe').annotate(
+        names=StringAgg('ingredient__name', delimiter=' ')
+    ).values('names')
+    Recipe.objects.update(search_vector=(
+        SearchVector('name', weight='A', config='russian')
+        + SearchVector(
+            Coalesce(
+                Subquery(ingredient_names),
+                Value(''),
+                output_field=models.TextField(),
+            ),
+            weight='B',
+            config='russian',
+        )
+        + SearchVector('text', weight='C', config='russian')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('foodgram', '0002_auto_20240619_0344'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='favorite',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='ingredientrecipe',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='foodgram.recipe', verbose_name='Рецепты'),
+        ),
+        migrations.AlterField(
+            model_name='shoppinglist',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipe_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='recipe_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.RunPython(fill_search_vector, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 4.2 on 2026-10-18 04:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def fill_cart_totals(apps, schema_editor):
+    IngredientRecipe = apps.get_model('foodgram', 'IngredientRecipe')
+    ShoppingList = apps.get_model('foodgram', 'ShoppingList')
+    ShoppingCartIngredient = apps.get_model(
+        'foodgram', 'ShoppingCartIngredient'
+    )
+    ShoppingCartVersion = apps.get_model('foodgram', 'ShoppingCartVersion')
+    totals = IngredientRecipe.objects.filter(
+        recipe__shopping_list__isnull=False
+    ).values(
+        'recipe__shopping_list__author', 'ingredient'
+    ).annotate(sum_amount=Sum('amount')).order_by()
+    ShoppingCartIngredient.objects.bulk_create(
+        ShoppingCartIngredient(
+            author_id=total['recipe__shopping_list__author'],
+            ingredient_id=total['ingredient'],
+            amount=total['sum_amount'],
+        )
+        for total in totals.iterator()
+    )
+    ShoppingCartVersion.objects.bulk_create(
+        ShoppingCartVersion(author_id=author_id, version=1)
+        for author_id in ShoppingList.objects.values_list(
+            'author', flat=True
+        ).distinct().order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0002_user_manager'),
+        ('foodgram', '0003_recipe_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartVersion',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cart_version', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия корзины',
+                'verbose_name_plural': 'Версии корзин',
+            },
+        ),
+        migrations.CreateModel(
+            name='ShoppingCartIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.BigIntegerField(default=0, verbose_name='Количество ингредиента')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='foodgram.ingredient', verbose_name='Ингредиент')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент корзины',
+                'verbose_name_plural': 'Ингредиенты корзины',
+                'default_related_name': 'cart_ingredients',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartingredient',
+            constraint=models.UniqueConstraint(fields=('author', 'ingredient'), name='cart_ingredient_author'),
+        ),
+        migrations.RunPython(fill_cart_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0005_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-created_at', 'id'], name='recipe_created_at_id_idx'),
+        ),
+    ]
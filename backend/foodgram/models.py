@@ -1,8 +1,18 @@
+from collections import defaultdict
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField,
+                                            TrigramWordSimilarity)
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connection, models
+from django.db.models import F, OuterRef, Prefetch, Q, Subquery, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
 
-from users.constaints import (COLOR_VALIDATOR, TAG_INGREDIENT_MAX_LENGTH,
-                              TAG_MAX_LENGTH_HEX)
+from users.constaints import (COLOR_VALIDATOR, SEARCH_CONFIG,
+                              TAG_INGREDIENT_MAX_LENGTH, TAG_MAX_LENGTH_HEX)
 from users.models import User
 
 
@@ -49,6 +59,87 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Выборки рецептов для чтения."""
+
+    def touch(self):
+        """Отметка об изменении рецептов для условных запросов."""
+        return self.update(updated_at=timezone.now())
+
+    def lock_shared(self, recipe_ids):
+        """Блокировка FOR SHARE на время изменения корзин с рецептами.
+
+        Не пересекается с другими корзинами, но ждёт правку состава,
+        которая держит рецепт FOR UPDATE.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id FROM {self.model._meta.db_table} '
+                f'WHERE id = ANY(%s) ORDER BY id FOR SHARE',
+                [list(recipe_ids)]
+            )
+
+    def with_related(self):
+        """Автор, теги и ингредиенты рецептов фиксированным числом запросов."""
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredient_recipe',
+                queryset=IngredientRecipe.objects.select_related('ingredient'),
+            ),
+        )
+
+    def author_previews(self, author_ids, limit):
+        """Последние рецепты каждого автора одним оконным запросом."""
+        recipes = self.filter(author_id__in=author_ids).only(
+            'id', 'author_id', 'name', 'image', 'cooking_time', 'created_at',
+        ).annotate(row_number=Window(
+            RowNumber(),
+            partition_by=F('author_id'),
+            order_by=F('created_at').desc(),
+        )).filter(row_number__lte=limit)
+        previews = defaultdict(list)
+        for recipe in recipes:
+            previews[recipe.author_id].append(recipe)
+        return previews
+
+    def update_search_vector(self):
+        """Пересчёт поискового вектора: название, ингредиенты, описание."""
+        ingredient_names = IngredientRecipe.objects.filter(
+            recipe=OuterRef('pk')
+        ).values('recipe').annotate(
+            names=StringAgg('ingredient__name', delimiter=' ')
+        ).values('names')
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(
+                Coalesce(
+                    Subquery(ingredient_names),
+                    Value(''),
+                    output_field=models.TextField(),
+                ),
+                weight='B',
+                config=SEARCH_CONFIG,
+            )
+            + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+        ))
+
+    def search(self, query):
+        """Полнотекстовый поиск с допуском опечаток в названии."""
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return self.filter(
+            Q(search_vector=search_query)
+            | Q(name__trigram_word_similar=query)
+        ).annotate(
+            rank=(
+                SearchRank(F('search_vector'), search_query)
+                + TrigramWordSimilarity(query, 'name')
+            )
+        ).order_by('-rank', '-created_at')
+
+
 class Recipe(models.Model):
     """Модель рецептов."""
     author = models.ForeignKey(
@@ -84,11 +175,40 @@ class Recipe(models.Model):
     )
     created_at = models.DateTimeField(
         'Добавлено', auto_now_add=True)
+    updated_at = models.DateTimeField(
+        'Изменено', auto_now=True)
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии изображения',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-created_at',)
+        indexes = [
+            models.Index(
+                fields=['-created_at', 'id'],
+                name='recipe_created_at_id_idx',
+            ),
+            GinIndex(
+                fields=['search_vector'],
+                name='recipe_search_vector_idx',
+            ),
+            GinIndex(
+                fields=['name'],
+                opclasses=['gin_trgm_ops'],
+                name='recipe_name_trgm_idx',
+            ),
+        ]
 
 
 class IngredientRecipe(models.Model):
@@ -124,6 +244,33 @@ class IngredientRecipe(models.Model):
         ]
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    """Добавление и удаление рецепта у пользователя одним запросом."""
+
+    def add(self, author_id, recipe_id):
+        """Вставка без ошибки при гонке; False, если строка уже есть."""
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (author_id, recipe_id) '
+                f'SELECT %s, id FROM {Recipe._meta.db_table} WHERE id = %s '
+                f'FOR SHARE '
+                f'ON CONFLICT (author_id, recipe_id) DO NOTHING RETURNING id',
+                [author_id, recipe_id]
+            )
+            return cursor.fetchone() is not None
+
+    def remove(self, author_id, recipe_id):
+        """True, если строка была и удалена именно этим запросом."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.model._meta.db_table} '
+                f'WHERE author_id = %s AND recipe_id = %s RETURNING id',
+                [author_id, recipe_id]
+            )
+            return cursor.fetchone() is not None
+
+
 class ShoppingList(models.Model):
     """Модель списка покупок."""
     author = models.ForeignKey(
@@ -136,6 +283,8 @@ class ShoppingList(models.Model):
         related_name='shopping_list',
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ('author',)
         default_related_name = 'carts_list'
@@ -162,6 +311,8 @@ class Favorite(models.Model):
         related_name='favorite'
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = 'Избранные рецепты'
         ordering = ('author',)
@@ -172,3 +323,211 @@ class Favorite(models.Model):
                 name='favorite_author_recipe'
             )
         ]
+
+
+class ShoppingCartIngredientQuerySet(models.QuerySet):
+    """Поддержание сумм ингредиентов корзины при её изменении."""
+
+    def _cart_filter(self, author_id):
+        if author_id is None:
+            return '', []
+        return 'AND sl.author_id = %s', [author_id]
+
+    def add_recipe(self, recipe_id, author_id=None):
+        """Прибавляет ингредиенты рецепта к корзинам, где он лежит.
+
+        Без author_id обновляются корзины всех пользователей,
+        добавивших рецепт, например после правки его ингредиентов.
+        """
+        self.add_recipes([recipe_id], author_id)
+
+    def add_recipes(self, recipe_ids, author_id=None):
+        """То же для нескольких рецептов одним запросом."""
+        author_filter, params = self._cart_filter(author_id)
+        totals = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {totals} (author_id, ingredient_id, amount) '
+                f'SELECT sl.author_id, ir.ingredient_id, SUM(ir.amount) '
+                f'FROM {IngredientRecipe._meta.db_table} ir '
+                f'JOIN {ShoppingList._meta.db_table} sl '
+                f'ON sl.recipe_id = ir.recipe_id '
+                f'WHERE ir.recipe_id = ANY(%s) {author_filter} '
+                f'GROUP BY sl.author_id, ir.ingredient_id '
+                f'ON CONFLICT (author_id, ingredient_id) DO UPDATE '
+                f'SET amount = {totals}.amount + EXCLUDED.amount',
+                [list(recipe_ids), *params]
+            )
+        ShoppingCartVersion.objects.bump(recipe_ids, author_id)
+
+    def remove_recipe(self, recipe_id, author_id=None):
+        """Вычитает ингредиенты рецепта из корзин, где он лежит."""
+        author_filter, params = self._cart_filter(author_id)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {self.model._meta.db_table} t '
+                f'SET amount = t.amount - ir.amount '
+                f'FROM {IngredientRecipe._meta.db_table} ir '
+                f'JOIN {ShoppingList._meta.db_table} sl '
+                f'ON sl.recipe_id = ir.recipe_id '
+                f'WHERE ir.recipe_id = %s {author_filter} '
+                f'AND t.author_id = sl.author_id '
+                f'AND t.ingredient_id = ir.ingredient_id',
+                [recipe_id, *params]
+            )
+        carts = ShoppingList.objects.filter(recipe_id=recipe_id)
+        if author_id is not None:
+            carts = carts.filter(author_id=author_id)
+        self.filter(
+            amount__lte=0,
+            author__in=carts.values('author_id'),
+        ).delete()
+        ShoppingCartVersion.objects.bump([recipe_id], author_id)
+
+    def subtract_recipe(self, recipe_id, author_id):
+        """Вычитает рецепт из корзины, когда строки ShoppingList уже нет."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {self.model._meta.db_table} t '
+                f'SET amount = t.amount - ir.amount '
+                f'FROM {IngredientRecipe._meta.db_table} ir '
+                f'WHERE ir.recipe_id = %s AND t.author_id = %s '
+                f'AND t.ingredient_id = ir.ingredient_id',
+                [recipe_id, author_id]
+            )
+        self.filter(author_id=author_id, amount__lte=0).delete()
+        ShoppingCartVersion.objects.bump_author(author_id)
+
+
+class ShoppingCartIngredient(models.Model):
+    """Модель суммарного количества ингредиента в корзине."""
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    amount = models.BigIntegerField(
+        default=0,
+        verbose_name='Количество ингредиента',
+    )
+
+    objects = ShoppingCartIngredientQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Ингредиент корзины'
+        verbose_name_plural = 'Ингредиенты корзины'
+        default_related_name = 'cart_ingredients'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['author', 'ingredient'],
+                name='cart_ingredient_author'
+            )
+        ]
+
+
+class ShoppingCartVersionQuerySet(models.QuerySet):
+    """Версии корзин."""
+
+    def bump(self, recipe_ids, author_id=None):
+        """Новая версия корзин, в которых лежит любой из рецептов."""
+        author_filter = 'AND author_id = %s' if author_id is not None else ''
+        versions = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {versions} (author_id, version) '
+                f'SELECT DISTINCT author_id, 1 '
+                f'FROM {ShoppingList._meta.db_table} '
+                f'WHERE recipe_id = ANY(%s) {author_filter} '
+                f'ON CONFLICT (author_id) DO UPDATE '
+                f'SET version = {versions}.version + 1',
+                [list(recipe_ids)]
+                + ([author_id] if author_id is not None else [])
+            )
+
+    def bump_author(self, author_id):
+        """Новая версия корзины пользователя."""
+        versions = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {versions} (author_id, version) VALUES (%s, 1) '
+                f'ON CONFLICT (author_id) DO UPDATE '
+                f'SET version = {versions}.version + 1',
+                [author_id]
+            )
+
+    def get_version(self, author):
+        return self.filter(author=author).values_list(
+            'version', flat=True
+        ).first() or 0
+
+
+class ShoppingCartVersion(models.Model):
+    """Модель версии корзины: меняется при каждом изменении корзины."""
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='cart_version',
+        verbose_name='Пользователь',
+    )
+    version = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Версия',
+    )
+
+    objects = ShoppingCartVersionQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Версия корзины'
+        verbose_name_plural = 'Версии корзин'
+
+
+class ImageBlobQuerySet(models.QuerySet):
+    """Счётчики ссылок на файлы изображений."""
+
+    def acquire(self, name, size):
+        """Ещё одна ссылка на файл; возвращает число ссылок."""
+        blobs = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {blobs} (name, size, refs, created_at) '
+                f'VALUES (%s, %s, 1, %s) '
+                f'ON CONFLICT (name) DO UPDATE '
+                f'SET refs = {blobs}.refs + 1 RETURNING refs',
+                [name, size, timezone.now()]
+            )
+            return cursor.fetchone()[0]
+
+    def release(self, name):
+        """Минус одна ссылка; сам файл удаляет только сборка мусора."""
+        self.filter(name=name, refs__gt=0).update(refs=F('refs') - 1)
+
+
+class ImageBlob(models.Model):
+    """Модель файла изображения, названного по хешу содержимого."""
+    name = models.CharField(
+        max_length=255,
+        primary_key=True,
+        verbose_name='Путь к файлу',
+    )
+    size = models.BigIntegerField(
+        verbose_name='Размер, байт',
+    )
+    refs = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число ссылок',
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Загружен',
+    )
+
+    objects = ImageBlobQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Файл изображения'
+        verbose_name_plural = 'Файлы изображений'
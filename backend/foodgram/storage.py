@@ -0,0 +1,66 @@
+import hashlib
+import os
+import tempfile
+from pathlib import PurePosixPath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+from foodgram.models import ImageBlob
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, где файл назван по SHA-256 своего содержимого.
+
+    Повторная загрузка той же картинки не пишет файл заново, а лишь
+    увеличивает счётчик ссылок в ImageBlob. delete() уменьшает
+    счётчик, а файлы без ссылок удаляет команда media_blobs --reclaim.
+    """
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        path = PurePosixPath(name)
+        return str(
+            path.parent / digest[:2] / f'{digest}{path.suffix.lower()}'
+        )
+
+    def _write(self, name, content):
+        """Запись через временный файл: файл появляется целиком."""
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    temp_file.write(chunk)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        refs = ImageBlob.objects.acquire(name, content.size)
+        if refs == 1 or not self.exists(name):
+            self._write(name, content)
+        return name
+
+    def delete(self, name):
+        ImageBlob.objects.release(name)
+
+    def reclaim(self, name):
+        """Удаление файла, на который не осталось ссылок."""
+        super().delete(name)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -21,6 +22,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'api.apps.ApiConfig',
@@ -32,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -106,6 +109,27 @@ STATIC_ROOT = BASE_DIR / 'static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'foodgram.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf',
+)
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+INGREDIENT_INDEX_PATH = os.getenv(
+    'INGREDIENT_INDEX_PATH',
+    os.path.join(tempfile.gettempdir(), 'foodgram_ingredients.idx'),
+)
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -122,6 +146,25 @@ REST_FRAMEWORK = {
         ['django_filters.rest_framework.DjangoFilterBackend'],
 }
 
+ANONYMOUS_PAGE_CACHE_TTL = int(os.getenv('ANONYMOUS_PAGE_CACHE_TTL', 600))
+
+VERSIONED_LIST_CACHE_TTL = int(
+    os.getenv('VERSIONED_LIST_CACHE_TTL', 86400)
+)
+
+RECIPE_FRAGMENT_CACHE_TTL = int(
+    os.getenv('RECIPE_FRAGMENT_CACHE_TTL', 3600)
+)
+
+MEMBERSHIP_CACHE_TTL = int(os.getenv('MEMBERSHIP_CACHE_TTL', 300))
+
+PAGINATION_COUNT_CACHE_TTL = int(
+    os.getenv('PAGINATION_COUNT_CACHE_TTL', 30)
+)
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(
+    os.getenv('PAGINATION_COUNT_ESTIMATE_THRESHOLD', 100000)
+)
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'SERIALIZERS': {
@@ -139,6 +182,50 @@ DJOSER = {
     },
 }
 
+# В продакшене кэш общий для всех воркеров: Redis, см. CACHE_BACKEND и
+# CACHE_LOCATION в docker-compose.production.yml. Файловый кэш годится
+# только для разработки: каждая запись перечисляет каталог, а при
+# переполнении удаляет случайную часть файлов, включая ключи версий.
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND',
+    'django.core.cache.backends.filebased.FileBasedCache',
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram_cache'),
+        ),
+    }
+}
+
+if CACHE_BACKEND.endswith('FileBasedCache'):
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100000)),
+        'CULL_FREQUENCY': 10,
+    }
+
+SLOW_REQUEST_THRESHOLD_MS = int(os.getenv('SLOW_REQUEST_THRESHOLD_MS', 500))
+
+DUPLICATE_QUERY_THRESHOLD = int(os.getenv('DUPLICATE_QUERY_THRESHOLD', 5))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.middleware': {
+            'handlers': ['console'],
+            'level': os.getenv('PERFORMANCE_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
@@ -0,0 +1,20 @@
+import os
+import shutil
+
+# Задаётся до импорта prometheus_client в воркерах: по этой переменной
+# библиотека решает, хранить ли значения метрик в файлах.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/foodgram_metrics')
+
+
+def on_starting(server):
+    """Метрики прошлого запуска удаляются до старта воркеров."""
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    """Файлы завершившегося воркера больше не считаются живыми."""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
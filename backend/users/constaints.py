@@ -7,3 +7,6 @@ TAG_MAX_LENGTH_HEX = 7
 TAG_INGREDIENT_MAX_LENGTH = 200
 COLOR_VALIDATOR = RegexValidator(regex=r'^#[0-9A-Fa-f]{6}$')
 LIMIT_RECIPES = 6
+SEARCH_CONFIG = 'russian'
+IMAGE_VARIANT_SIZES = {'retina': 2048, 'detail': 1024, 'card': 480}
+BATCH_MAX_SIZE = 100
@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-18 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_manager'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'DELETE FROM users_followuser WHERE user_id = author_id',
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='followuser',
+            constraint=models.CheckConstraint(check=models.Q(('user', models.F('author')), _negated=True), name='prevent_self_subscribe'),
+        ),
+    ]
@@ -1,9 +1,27 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.auth.models import UserManager as BaseUserManager
+from django.db import connection, models
+from django.db.models import Count, Exists, F, OuterRef, Q, Value
 
 from users.constaints import EMAIL_MAX_LENGTH, USER_MAX_LENGTH, USERNAME_REGEX
 
 
+class UserQuerySet(models.QuerySet):
+    """Выборки пользователей."""
+
+    def with_is_subscribed(self, user):
+        """Подписан ли текущий пользователь на каждого из выбранных."""
+        if not user.is_authenticated:
+            return self.annotate(is_subscribed=Value(False))
+        return self.annotate(is_subscribed=Exists(
+            FollowUser.objects.filter(user=user, author=OuterRef('pk'))
+        ))
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    """Менеджер пользователей с выборками для API."""
+
+
 class User(AbstractUser):
     """Модель пользователя."""
     username = models.CharField(
@@ -29,11 +47,46 @@ class User(AbstractUser):
     )
     REQUIRED_FIELDS = ('first_name', 'last_name', 'email')
 
+    objects = UserManager()
+
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
 
 
+class FollowUserQuerySet(models.QuerySet):
+    """Выборки подписок."""
+
+    def with_author_summary(self):
+        """Автор подписки и число его рецептов."""
+        return self.select_related('author').annotate(
+            recipes_count=Count('author__recipes'),
+            is_subscribed=Value(True),
+        )
+
+    def add(self, user_id, author_id):
+        """Вставка без ошибки при гонке; False, если подписка не нужна."""
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, author_id) '
+                f'SELECT %s, id FROM {User._meta.db_table} WHERE id = %s '
+                f'ON CONFLICT (user_id, author_id) DO NOTHING RETURNING id',
+                [user_id, author_id]
+            )
+            return cursor.fetchone() is not None
+
+    def remove(self, user_id, author_id):
+        """True, если подписка была и удалена именно этим запросом."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.model._meta.db_table} '
+                f'WHERE user_id = %s AND author_id = %s RETURNING id',
+                [user_id, author_id]
+            )
+            return cursor.fetchone() is not None
+
+
 class FollowUser(models.Model):
     """Модель подписок."""
     user = models.ForeignKey(
@@ -46,6 +99,8 @@ class FollowUser(models.Model):
         related_name='creator',
         verbose_name='Автор',)
 
+    objects = FollowUserQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
@@ -54,5 +109,9 @@ class FollowUser(models.Model):
             models.UniqueConstraint(
                 fields=['user', 'author'],
                 name='unique_subscribe_user'
-            )
+            ),
+            models.CheckConstraint(
+                check=~Q(user=F('author')),
+                name='prevent_self_subscribe'
+            ),
         ]